@@ -0,0 +1,74 @@
+import json
+from pygame.math import Vector2
+from model.road import RoadLine
+
+# Default distance between parallel roads, in road map units
+DEFAULT_SPACING = 4
+
+# Returns a road line between two road map points
+def line(startX: float, startY: float, endX: float, endY: float) -> RoadLine:
+    return RoadLine(Vector2(startX, startY), Vector2(endX, endY))
+
+# Grid of [size] x [size] blocks. Every inner crossing becomes a roundabout,
+# and every crossing on the border a T intersection
+def gridMap(size: int, spacing: int = DEFAULT_SPACING) -> list[RoadLine]:
+    assert size > 0, "Grid size must be positive"
+
+    lines: list[RoadLine] = []
+    length = size * spacing
+    for i in range(size + 1):
+        lines.append(line(0, i * spacing, length, i * spacing))
+        lines.append(line(i * spacing, 0, i * spacing, length))
+    return lines
+
+# [numRings] concentric square ring roads, connected to each other by a road
+# on the middle of each side. The innermost ring is [spacing] * 2 wide
+def ringMap(numRings: int, spacing: int = DEFAULT_SPACING) -> list[RoadLine]:
+    assert numRings > 0, "Number of rings must be positive"
+
+    lines: list[RoadLine] = []
+    outer = numRings * spacing
+    center = outer
+    for ring in range(1, numRings + 1):
+        low = center - ring * spacing
+        high = center + ring * spacing
+        lines.append(line(low, low, high, low))
+        lines.append(line(high, low, high, high))
+        lines.append(line(high, high, low, high))
+        lines.append(line(low, high, low, low))
+
+    # Spokes from the innermost to the outermost ring
+    if numRings > 1:
+        inner = spacing
+        lines.append(line(center, center - outer, center, center - inner))
+        lines.append(line(center, center + inner, center, center + outer))
+        lines.append(line(center - outer, center, center - inner, center))
+        lines.append(line(center + inner, center, center + outer, center))
+    return lines
+
+# Chain of [numRoundabouts] roundabouts along a middle road, between two
+# parallel roads (like a ladder, with the roundabouts on each inner rung)
+def roundaboutChainMap(numRoundabouts: int, spacing: int = DEFAULT_SPACING) -> list[RoadLine]:
+    assert numRoundabouts > 0, "Number of roundabouts must be positive"
+
+    lines: list[RoadLine] = []
+    length = (numRoundabouts + 1) * spacing
+    height = spacing
+    lines.append(line(0, 0, length, 0))
+    lines.append(line(0, height, length, height))
+    lines.append(line(0, height * 2, length, height * 2))
+    for i in range(numRoundabouts + 2):
+        lines.append(line(i * spacing, 0, i * spacing, height * 2))
+    return lines
+
+# Synthetic map generators, keyed by map kind
+mapGenerators = {
+    "grid": gridMap,
+    "ring": ringMap,
+    "roundabouts": roundaboutChainMap,
+}
+
+# Saves road lines to a road map JSON file, same format as the map editor
+def writeRoadMap(lines: list[RoadLine], filePath: str) -> None:
+    with open(filePath, "w") as f:
+        json.dump([line.toJSON() for line in lines], f, indent=4)
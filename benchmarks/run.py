@@ -0,0 +1,218 @@
+# Benchmarks for the simulation hot paths, on synthetic maps of increasing
+# size. Run from the repo root with:
+#
+#   python3 -m benchmarks.run [--quick] [--output FILE]
+#
+# Results are printed and saved as JSON, so runs from different versions can
+# be compared
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from random import Random
+from typing import Callable
+
+# NOTE: Rendering benchmarks don't need a visible window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+import utils
+from benchmarks.maps import mapGenerators, writeRoadMap
+from model.road_map_cache import loadCompiledRoadMap
+from model.traffic_sim import TrafficSim, ROAD_WIDTH, CURVE_ARC_OFFSET
+
+# Version of the results file layout
+RESULTS_FORMAT_VERSION = 1
+
+# Default results file
+DEFAULT_OUTPUT = "benchmark_results.json"
+
+# Map sizes benchmarked for each map kind
+MAP_SIZES: dict[str, list[int]] = {
+    "grid": [2, 4, 8],
+    "ring": [2, 4, 8],
+    "roundabouts": [4, 8, 16],
+}
+
+# Cars spawned per map size unit
+CARS_PER_SIZE = 8
+
+# Simulation time step used by all benchmarks
+SIM_DT = 1 / 60
+
+# Ticks simulated before timing anything that depends on traffic, so cars
+# are already driving around
+WARMUP_TICKS = 60
+
+# Number of random (start, goal) pairs used by the path benchmarks
+NUM_PATHS = 200
+
+# Window size for rendering benchmarks
+RENDER_WIDTH = 800
+RENDER_HEIGHT = 600
+
+# Times [fn] [repeats] times, returning statistics of the time per call (in
+# seconds). [number] is how many operations each call does
+def measure(fn: Callable[[], object], repeats: int, number: int = 1) -> dict:
+    times: list[float] = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) / number)
+
+    return {
+        "repeats": repeats,
+        "number": number,
+        "mean": statistics.fmean(times),
+        "median": statistics.median(times),
+        "min": min(times),
+        "max": max(times),
+    }
+
+# Runs all benchmarks for one map, returning one result per benchmark
+def benchmarkMap(kind: str, size: int, mapPath: str, repeats: int, seed: int) -> list[dict]:
+    results: list[dict] = []
+    numCars = size * CARS_PER_SIZE
+
+    # Adds a result row, and prints it
+    def record(name: str, stats: dict, **extra) -> None:
+        row = {"benchmark": name, "map": kind, "size": size, **extra, **stats}
+        results.append(row)
+        print(f"  {name:<28} {stats['mean'] * 1000:10.3f} ms  (min {stats['min'] * 1000:.3f} ms)")
+
+    print(f"{kind} {size}:")
+
+    # Map loading
+    # -----------
+    record(
+        "loadRoadMap.compile",
+        measure(lambda: loadCompiledRoadMap(mapPath, ROAD_WIDTH, CURVE_ARC_OFFSET, useCache=False), repeats),
+    )
+
+    # First load saves the compiled map, next ones read it
+    loadCompiledRoadMap(mapPath, ROAD_WIDTH, CURVE_ARC_OFFSET)
+    record(
+        "loadRoadMap.cached",
+        measure(lambda: loadCompiledRoadMap(mapPath, ROAD_WIDTH, CURVE_ARC_OFFSET), repeats),
+    )
+
+    # Paths
+    # -----
+    sim = TrafficSim(ROAD_WIDTH, CURVE_ARC_OFFSET, mapPath, numCars, headless=True, seed=seed)
+    graph = sim.roadGraph
+    rng = Random(seed)
+    pairs = [
+        (graph.pointIdsList[rng.randrange(len(graph.pointIdsList))], graph.pointIdsList[rng.randrange(len(graph.pointIdsList))])
+        for _ in range(NUM_PATHS)
+    ]
+    nodes = {"nodes": graph.numNodes(), "edges": len(graph.targetsList)}
+    record(
+        "A_Star",
+        measure(lambda: [utils.A_Star(graph, start, goal) for start, goal in pairs], repeats, len(pairs)),
+        **nodes,
+    )
+
+    paths = [p for p in (utils.A_Star(graph, start, goal) for start, goal in pairs) if p is not None and len(p) > 1]
+    record(
+        "smoothPathCurves",
+        measure(lambda: [utils.smoothPathCurves(p) for p in paths], repeats, max(1, len(paths))),
+        **nodes,
+    )
+
+    # Traffic
+    # -------
+    for _ in range(WARMUP_TICKS):
+        sim.update(SIM_DT)
+    cars = {"cars": len(sim.drivers)}
+    drivers = sim.drivers
+
+    # Checks collisions the same way TrafficSim.update does
+    def checkCollisions() -> None:
+        sim.rebuildDriverGrid(0)
+        for driver in drivers:
+            driver.checkCarCollisions(driver.nearbyDrivers(sim.driverGrid))
+
+    record("checkCarCollisions", measure(checkCollisions, repeats, max(1, len(drivers))), **cars)
+    record(
+        "Car.update",
+        measure(lambda: [driver.car.update(SIM_DT) for driver in drivers], repeats, max(1, len(drivers))),
+        **cars,
+    )
+    record("TrafficSim.update", measure(lambda: sim.update(SIM_DT), repeats), **cars)
+
+    batchSim = TrafficSim(ROAD_WIDTH, CURVE_ARC_OFFSET, mapPath, numCars, headless=True, batchPhysics=True, seed=seed)
+    for _ in range(WARMUP_TICKS):
+        batchSim.update(SIM_DT)
+    record("TrafficSim.update.batch", measure(lambda: batchSim.update(SIM_DT), repeats), **cars)
+
+    # Rendering
+    # ---------
+    # NOTE: Imported here, since the app opens a (dummy) window
+    from view.simulation import TrafficSimulationApp
+
+    app = TrafficSimulationApp(RENDER_WIDTH, RENDER_HEIGHT, mapPath, numCars, seed=seed)
+    for _ in range(WARMUP_TICKS):
+        app.onUpdate(SIM_DT)
+    record("TrafficSimulationApp.frame", measure(lambda: app.onUpdate(SIM_DT), repeats), **cars)
+
+    return results
+
+# Returns current git commit of the repo, if available
+def gitCommit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks for the traffic simulation hot paths")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON file results are saved to")
+    parser.add_argument("--kinds", nargs="+", choices=list(mapGenerators), default=list(mapGenerators), help="map kinds to benchmark")
+    parser.add_argument("--repeats", type=int, default=10, help="times each benchmark is repeated")
+    parser.add_argument("--seed", type=int, default=0, help="seed for cars and paths")
+    parser.add_argument("--quick", action="store_true", help="only the smallest map of each kind, with fewer repeats")
+    args = parser.parse_args(argv)
+
+    repeats = min(args.repeats, 3) if args.quick else args.repeats
+    results: list[dict] = []
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for kind in args.kinds:
+            sizes = MAP_SIZES[kind][:1] if args.quick else MAP_SIZES[kind]
+            for size in sizes:
+                mapPath = os.path.join(tmpDir, f"{kind}_{size}.json")
+                writeRoadMap(mapGenerators[kind](size), mapPath)
+                results.extend(benchmarkMap(kind, size, mapPath, repeats, args.seed))
+
+    report = {
+        "formatVersion": RESULTS_FORMAT_VERSION,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": gitCommit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "seed": args.seed,
+        "quick": args.quick,
+        "unit": "seconds",
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"\nSaved {len(results)} results to \"{args.output}\"")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,13 +1,23 @@
+import argparse
 import json
 import os
 import os.path
-# NOTE: This is used to hide pygame welcome message
-import contextlib
-with contextlib.redirect_stdout(None):
-    import pygame
+import sys
+
+# NOTE: pygame is only imported by the commands that need it, this hides its
+# welcome message when they do
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
 
 # Maximum cars in simulation
-MAX_CARS_SIMULATION = 20
+MAX_CARS_SIMULATION = 500
+
+# Default window size and frame rate of the apps
+DEFAULT_WINDOW_WIDTH = 600
+DEFAULT_WINDOW_HEIGHT = 600
+DEFAULT_FPS = 60
+
+# Default number of ticks simulated by headless runs (one simulated minute)
+DEFAULT_HEADLESS_TICKS = 3600
 
 # Gets user bool input (yes/no)
 def getUserBoolInput(prompt: str):
@@ -16,32 +26,20 @@ def getUserBoolInput(prompt: str):
 
     return len(res) == 0 or res[0] == "y"
 
-# Runs a simulation app with the selected map
-def runSimulationApp() -> None:
-    # List all available maps
-    files = os.listdir("./road_maps")
+# Lists available road maps and asks the user to choose one.
+# Returns the chosen map file path, or None if no valid map was chosen
+def selectRoadMapFile() -> str | None:
+    # List all available maps, without their .json extension. The folder also
+    # has compiled maps (and their temporary files while being saved), which
+    # are skipped
+    files = sorted(f[:-5] for f in os.listdir("./road_maps") if f.lower().endswith(".json"))
     if len(files) == 0:
         print(
             "[WARNING]: No road map files found on default folder "
             "\"traffic-sim/road_maps\". Create one with the"
             " editor and save it to a file to use it on a simulation",
         )
-        return
-
-    # Filter files
-    for i in range(len(files) - 1, -1, -1):
-        file = files[i]
-        if len(file) < 5:
-            # Not enough length for .json extension
-            files.remove(file)
-
-        # Check for json extension
-        if file[-5:].lower() != ".json":
-            # No json extension
-            files.remove(file)
-
-        # Valid json, remove extension
-        files[i] = file[:-5]
+        return None
 
     print("\nAvailable maps:")
     for i, file in enumerate(files):
@@ -54,42 +52,87 @@ def runSimulationApp() -> None:
         index = int(index)
         if index <= 0 or index > len(files):
             print("\nInvalid number")
-            return
+            return None
     except ValueError:
-        return
+        return None
 
-    # How many cars in the simulation
+    return f"./road_maps/{files[index - 1]}.json"
+
+# Gets the number of cars in the simulation from user input.
+# Returns None if input is invalid
+def getNumCarsInput() -> int | None:
     print(f"\nHow many cars in the simulation? [1-{MAX_CARS_SIMULATION}]")
     numCars = input("> ").strip()
     try:
         numCars = int(numCars)
         if numCars <= 0 or numCars > MAX_CARS_SIMULATION:
             print("\nInvalid input: Number out of range")
-            return
+            return None
     except ValueError:
         print("Invalid input: Not a number")
+        return None
+
+    return numCars
+
+# Runs a simulation app with the selected map
+def runSimulationApp() -> None:
+    roadMapFilePath = selectRoadMapFile()
+    if roadMapFilePath is None:
         return
 
-    # Create and run app
+    # How many cars in the simulation
+    numCars = getNumCarsInput()
+    if numCars is None:
+        return
+
+    simulate(roadMapFilePath, numCars)
+
+# Creates and runs a simulation app
+def simulate(
+    roadMapFilePath: str,
+    numCars: int,
+    width: int = DEFAULT_WINDOW_WIDTH,
+    height: int = DEFAULT_WINDOW_HEIGHT,
+    fps: float = DEFAULT_FPS,
+    seed: int | None = None,
+    profile: bool = False,
+) -> None:
     from view.simulation import TrafficSimulationApp
 
     app = TrafficSimulationApp(
-        600,
-        600,
+        width,
+        height,
         numCars=numCars,
-        roadMapFilePath=f"./road_maps/{files[index - 1]}.json",
-        fps=60,
+        roadMapFilePath=roadMapFilePath,
+        fps=fps,
+        seed=seed,
+        profile=profile,
     )
     app.run()
 
+# Saves the road lines of a map editor app to a road map file
+def saveRoadMap(app, filePath: str) -> None:
+    # Convert RoadLine objects to json
+    jsonLines = []
+    for line in app.roadLines:
+        jsonLines.append(line.toJSON())
+
+    # Save to json file
+    with open(filePath, "w") as f:
+        json.dump(jsonLines, f, indent=4)
+
 # Runs map editor app, possibly saving a map to a file
-def runMapEditorApp() -> None:
+def runMapEditorApp(
+    width: int = DEFAULT_WINDOW_WIDTH,
+    height: int = DEFAULT_WINDOW_HEIGHT,
+    fps: float = DEFAULT_FPS,
+) -> None:
     from view.map_editor import MapEditorApp
 
     # TODO: Check if user wants to start editor from an existing road map
 
     # Create and run app
-    app = MapEditorApp(600, 600, 60)
+    app = MapEditorApp(width, height, fps)
     app.run()
 
     # Check if user wants to save map
@@ -114,66 +157,123 @@ def runMapEditorApp() -> None:
         print("Name can't be empty.\n")
         name = input("> ").strip()
 
-    # Convert RoadLine objects to json
-    jsonLines = []
-    for line in app.roadLines:
-        jsonLines.append(line.toJSON())
-
-    # Save to json file
-    with open(f"./road_maps/{name}.json", "w") as f:
-        json.dump(jsonLines, f, indent=4)
+    saveRoadMap(app, f"./road_maps/{name}.json")
 
 # Runs a map loader with the selected map
 def runMapLoadingTestApp() -> None:
-    # List all available maps
-    files = os.listdir("./road_maps")
-    if len(files) == 0:
-        print(
-            "[WARNING]: No road map files found on default folder "
-            "\"traffic-sim/road_maps\". Create one with the"
-            " editor and save it to a file to use it on a simulation",
-        )
+    roadMapFilePath = selectRoadMapFile()
+    if roadMapFilePath is None:
         return
 
-    # Filter files
-    for i in range(len(files) - 1, -1, -1):
-        file = files[i]
-        if len(file) < 5:
-            # Not enough length for .json extension
-            files.remove(file)
+    runPathTest(roadMapFilePath)
+
+# Creates and runs a map loader app
+def runPathTest(
+    roadMapFilePath: str,
+    width: int = DEFAULT_WINDOW_WIDTH,
+    height: int = DEFAULT_WINDOW_HEIGHT,
+    fps: float = DEFAULT_FPS,
+) -> None:
+    from view.short_path_algo import ShortPathAlgorithmApp
 
-        # Check for json extension
-        if file[-5:].lower() != ".json":
-            # No json extension
-            files.remove(file)
+    app = ShortPathAlgorithmApp(
+        width,
+        height,
+        fps,
+        roadMapFilePath=roadMapFilePath,
+    )
+    app.run()
 
-        # Valid json, remove extension
-        files[i] = file[:-5]
+# Runs a simulation with the selected map without any window, as fast as possible
+def runHeadlessSimulation() -> None:
+    roadMapFilePath = selectRoadMapFile()
+    if roadMapFilePath is None:
+        return
 
-    print("\nAvailable maps:")
-    for i, file in enumerate(files):
-        print(f"[{i + 1}] {file}")
+    # How many cars in the simulation
+    numCars = getNumCarsInput()
+    if numCars is None:
+        return
 
-    # Check what map the user wants to use
-    print("\nChoose map by number:")
-    index = input("> ").strip()
+    # How many ticks to simulate
+    print("\nHow many ticks to simulate? (60 ticks = 1 simulated second)")
+    numTicks = input("> ").strip()
     try:
-        index = int(index)
-        if index <= 0 or index > len(files):
-            print("\nInvalid number")
+        numTicks = int(numTicks)
+        if numTicks <= 0:
+            print("\nInvalid input: Number must be positive")
             return
     except ValueError:
+        print("Invalid input: Not a number")
         return
 
-    from view.short_path_algo import ShortPathAlgorithmApp
+    # Random seed, so runs can be reproduced
+    print("\nRandom seed? (leave empty for a random run)")
+    seed = input("> ").strip()
+    if len(seed) == 0:
+        seed = None
+    else:
+        try:
+            seed = int(seed)
+        except ValueError:
+            print("Invalid input: Not a number")
+            return
 
-    app = ShortPathAlgorithmApp(
-        600,
-        600,
-        60,
-        roadMapFilePath=f"./road_maps/{files[index - 1]}.json",
+    runHeadless(roadMapFilePath, numCars, numTicks, seed)
+
+# Runs a headless simulation and prints its stats, also saving them as JSON
+# to [outputPath] if given
+def runHeadless(
+    roadMapFilePath: str,
+    numCars: int,
+    numTicks: int,
+    seed: int | None = None,
+    outputPath: str | None = None,
+    profile: bool = False,
+    recordPath: str | None = None,
+    loadSnapshotPath: str | None = None,
+    saveSnapshotPath: str | None = None,
+) -> None:
+    from model.headless import HeadlessSimulation
+    from model.trajectory import TrajectoryRecorder
+
+    # NOTE: Cars come from the snapshot when loading one
+    sim = HeadlessSimulation(
+        roadMapFilePath,
+        numCars if loadSnapshotPath is None else 0,
+        seed=seed,
+        profile=profile,
     )
-    app.run()
+    if loadSnapshotPath is not None:
+        with open(loadSnapshotPath, "rb") as f:
+            sim.trafficSim.restore(f.read())
+    if recordPath is None:
+        stats = sim.run(numTicks)
+    else:
+        # NOTE: Closed even if the run fails or is interrupted, so the ticks
+        # recorded so far are kept
+        with TrajectoryRecorder(recordPath, sim.trafficSim) as recorder:
+            sim.trafficSim.recorder = recorder
+            try:
+                stats = sim.run(numTicks)
+            finally:
+                sim.trafficSim.recorder = None
+        print(f"Recorded car trajectories to \"{recordPath}\"")
+    if saveSnapshotPath is not None:
+        sim.trafficSim.saveSnapshot(saveSnapshotPath)
+        print(f"Saved simulation snapshot to \"{saveSnapshotPath}\"")
+    print(
+        f"\nSimulated {stats['ticks']} ticks ({stats['simTime']:.1f}s) with "
+        f"{stats['cars']} cars in {stats['wallTime']:.2f}s "
+        f"({stats['ticksPerSecond']:.0f} ticks/s, {stats['speedup']:.1f}x real time)"
+    )
+    # NOTE: Restored simulations keep the seed of their snapshot
+    print(f"Final state hash (seed {stats['seed']}): {stats['stateHash']}")
+
+    if outputPath is not None:
+        with open(outputPath, "w") as f:
+            json.dump(stats, f, indent=4)
+        print(f"Saved stats to \"{outputPath}\"")
 
 def handleOption(option: int) -> None:
     # List of options
@@ -181,6 +281,7 @@ def handleOption(option: int) -> None:
         runSimulationApp,
         runMapEditorApp,
         runMapLoadingTestApp,
+        runHeadlessSimulation,
     ]
 
     # Check if option is valid
@@ -191,7 +292,8 @@ def handleOption(option: int) -> None:
     optionsList[option - 1]()
 
 
-def main() -> None:
+# Runs the interactive menu
+def runMenu() -> None:
     # Check if road maps dir exists
     if not os.path.exists("./road_maps"):
         os.mkdir("./road_maps")
@@ -203,6 +305,7 @@ def main() -> None:
     print("[1] Run simulation")
     print("[2] Open map editor")
     print("[3] Run map loading test")
+    print("[4] Run headless simulation")
     print("[0] Quit\n")
 
     # Get user option input
@@ -221,6 +324,168 @@ def main() -> None:
     # Handle selected option
     handleOption(optionInt)
 
+# Parses a positive integer argument
+def positiveInt(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"\"{value}\" is not a number")
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{number} is not positive")
+    return number
+
+# Returns parser for the command line interface
+def createParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Traffic simulation. Runs an interactive menu when no command is given",
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    # Options shared by commands
+    mapOptions = argparse.ArgumentParser(add_help=False)
+    mapOptions.add_argument("--map", required=True, help="road map file")
+
+    windowOptions = argparse.ArgumentParser(add_help=False)
+    windowOptions.add_argument("--width", type=positiveInt, default=DEFAULT_WINDOW_WIDTH, help="window width")
+    windowOptions.add_argument("--height", type=positiveInt, default=DEFAULT_WINDOW_HEIGHT, help="window height")
+    windowOptions.add_argument("--fps", type=positiveInt, default=DEFAULT_FPS, help="frames per second")
+
+    simOptions = argparse.ArgumentParser(add_help=False)
+    simOptions.add_argument("--cars", type=positiveInt, default=1, help="number of cars")
+    simOptions.add_argument("--seed", type=int, default=None, help="random seed, for reproducible runs")
+    simOptions.add_argument("--profile", action="store_true", help="profile simulation updates")
+
+    commands.add_parser(
+        "simulate",
+        parents=[mapOptions, simOptions, windowOptions],
+        help="run a simulation",
+    )
+
+    edit = commands.add_parser("edit", parents=[windowOptions], help="open the map editor")
+    edit.add_argument("--output", default=None, help="file the road map is saved to (asks when not given)")
+
+    commands.add_parser(
+        "pathtest",
+        parents=[mapOptions, windowOptions],
+        help="run the map loading and path finding test",
+    )
+
+    bench = commands.add_parser("bench", help="run the benchmarks")
+    bench.add_argument("--output", default=None, help="JSON file results are saved to")
+    bench.add_argument("--kinds", nargs="+", default=None, help="map kinds to benchmark")
+    bench.add_argument("--repeats", type=positiveInt, default=None, help="times each benchmark is repeated")
+    bench.add_argument("--seed", type=int, default=None, help="seed for cars and paths")
+    bench.add_argument("--quick", action="store_true", help="only the smallest maps, with fewer repeats")
+
+    headless = commands.add_parser(
+        "headless",
+        parents=[mapOptions, simOptions],
+        help="run a simulation without any window, as fast as possible",
+    )
+    headless.add_argument("--ticks", type=positiveInt, default=DEFAULT_HEADLESS_TICKS, help="ticks to simulate (60 ticks = 1 simulated second)")
+    headless.add_argument("--output", default=None, help="JSON file stats are saved to")
+    headless.add_argument("--record", default=None, help="file car trajectories are recorded to")
+    headless.add_argument("--load-snapshot", default=None, help="snapshot file the simulation starts from (instead of spawning cars)")
+    headless.add_argument("--save-snapshot", default=None, help="file the final simulation state is saved to")
+
+    replay = commands.add_parser(
+        "replay",
+        parents=[windowOptions],
+        help="replay car trajectories recorded by a headless run",
+    )
+    replay.add_argument("--file", required=True, help="recorded trajectories file")
+    replay.add_argument("--map", default=None, help="road map file (the recorded one by default)")
+
+    return parser
+
+# Runs the editor, saving the road map to [outputPath] if it's valid.
+# Returns whether it was saved
+def runEditor(outputPath: str, width: int, height: int, fps: float) -> bool:
+    from view.map_editor import MapEditorApp
+
+    app = MapEditorApp(width, height, fps)
+    app.run()
+    if not app.isRoadMapValid():
+        print("Road map is invalid, not saved")
+        return False
+
+    saveRoadMap(app, outputPath)
+    print(f"Saved road map to \"{outputPath}\"")
+    return True
+
+# Creates and runs a replay app for recorded car trajectories
+def runReplay(
+    trajectoryFilePath: str,
+    roadMapFilePath: str | None = None,
+    width: int = DEFAULT_WINDOW_WIDTH,
+    height: int = DEFAULT_WINDOW_HEIGHT,
+    fps: float = DEFAULT_FPS,
+) -> None:
+    from view.replay import ReplayApp
+
+    app = ReplayApp(width, height, trajectoryFilePath, fps, roadMapFilePath)
+    app.run()
+
+# Runs the benchmarks, passing on the given options
+def runBenchmarks(args: argparse.Namespace) -> None:
+    from benchmarks import run
+
+    argv: list[str] = []
+    if args.output is not None:
+        argv += ["--output", args.output]
+    if args.kinds is not None:
+        argv += ["--kinds", *args.kinds]
+    if args.repeats is not None:
+        argv += ["--repeats", str(args.repeats)]
+    if args.seed is not None:
+        argv += ["--seed", str(args.seed)]
+    if args.quick:
+        argv.append("--quick")
+    run.main(argv)
+
+def main(argv: list[str] | None = None) -> None:
+    parser = createParser()
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        runMenu()
+        return
+
+    if getattr(args, "map", None) is not None and not os.path.isfile(args.map):
+        parser.error(f"road map file \"{args.map}\" not found")
+
+    if args.command == "simulate":
+        simulate(args.map, args.cars, args.width, args.height, args.fps, args.seed, args.profile)
+    elif args.command == "edit":
+        if args.output is None:
+            # Maps are saved to the road maps dir
+            os.makedirs("./road_maps", exist_ok=True)
+            runMapEditorApp(args.width, args.height, args.fps)
+        elif not runEditor(args.output, args.width, args.height, args.fps):
+            sys.exit(1)
+    elif args.command == "pathtest":
+        runPathTest(args.map, args.width, args.height, args.fps)
+    elif args.command == "bench":
+        runBenchmarks(args)
+    elif args.command == "replay":
+        if not os.path.isfile(args.file):
+            parser.error(f"trajectories file \"{args.file}\" not found")
+        runReplay(args.file, args.map, args.width, args.height, args.fps)
+    elif args.command == "headless":
+        if args.load_snapshot is not None and not os.path.isfile(args.load_snapshot):
+            parser.error(f"snapshot file \"{args.load_snapshot}\" not found")
+        runHeadless(
+            args.map,
+            args.cars,
+            args.ticks,
+            args.seed,
+            args.output,
+            args.profile,
+            args.record,
+            args.load_snapshot,
+            args.save_snapshot,
+        )
+
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
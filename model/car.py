@@ -1,7 +1,14 @@
+# NOTE: This import is needed so classes can reference each other in type annotations
+from __future__ import annotations
 import pygame
 import math
+from typing import TYPE_CHECKING
 from pygame.math import Vector2
 import utils
+from model.sprite_atlas import SpriteAtlas, TextureKey, sharedSpriteAtlas
+
+if TYPE_CHECKING:
+    from model.car_state import CarStateStore
 
 # Wheel to car size ratio
 WHEEL_SIZE_RATIO = 0.22
@@ -39,6 +46,27 @@ DEBUG_DIRECTION_NORMAL_ARROW_COLOR = (0, 255, 0)
 # How fast the car steers
 STEERING_LERP_SPEED = 10
 
+# Car state attribute that can be stored either in the car itself or in a
+# CarStateStore the car is bound to, in which case the car is only a view
+# onto the store's arrays
+class CarStateField:
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+        self.privateName = "_" + name
+
+    def __get__(self, car: Car | None, owner: type | None = None):
+        if car is None:
+            return self
+        if car.stateStore is None:
+            return car.__dict__[self.privateName]
+        return car.stateStore.get(self.name, car.stateIndex)
+
+    def __set__(self, car: Car, value) -> None:
+        if car.stateStore is None:
+            car.__dict__[self.privateName] = value
+        else:
+            car.stateStore.set(self.name, car.stateIndex, value)
+
 # TODO: Change this to class Vehicle, and make other inherited classes such as:
 # - Car
 # - Bus
@@ -48,6 +76,18 @@ STEERING_LERP_SPEED = 10
 # Vehicles can have any amount of wheels with any offset, so only passing
 # wheel axis aspect ratio is not enough
 class Car:
+    # State attributes, see CarStateField
+    pos = CarStateField()
+    accelerationAmount = CarStateField()
+    brakeAmount = CarStateField()
+    reverse = CarStateField()
+    steering = CarStateField()
+    targetSteering = CarStateField()
+    velocity = CarStateField()
+    rotation = CarStateField()
+    accelerationSpeed = CarStateField()
+    brakeForce = CarStateField()
+
     def __init__(
         self,
         pos: Vector2,
@@ -56,8 +96,16 @@ class Car:
         textureScale: float=1.0,
         textureOffsetAngle: float=0,
         wheelAxisAspectRatio: float=1,
-        initialRotation: float=0
+        initialRotation: float=0,
+        loadTextures: bool=True,
+        spriteAtlas: SpriteAtlas | None=None,
     ) -> None:
+        # Store holding this car's state, if any (see CarStateStore.add)
+        self.stateStore: CarStateStore | None = None
+
+        # Index of this car in [stateStore]
+        self.stateIndex = -1
+
         # Car position
         self.pos = pos.copy()
 
@@ -91,45 +139,40 @@ class Car:
         # Car rotation/inclination
         self.rotation = utils.normalizeAngle(initialRotation)
 
+        # Car position and rotation before the last update, for drawing the
+        # car in between updates (see savePreviousState)
+        self.prevPos = self.pos.copy()
+        self.prevRotation = self.rotation
+
         # Car texture scale based on [size]
         self.textureScale = textureScale
 
         # Aspect ratio for distance between left-right wheels and front-back wheels
         self.wheelAxisAspectRatio = wheelAxisAspectRatio
 
-        # Try loading image
-        try:
-            # Load
-            self.texture = pygame.image.load(texturePath)
-            # Rotate
-            self.texture = pygame.transform.rotate(self.texture, textureOffsetAngle)
-            # Resize
-            texSize = Vector2(self.texture.get_size())
-            texAspectRatio = texSize.y / texSize.x
-            self.texture = pygame.transform.scale(
-                self.texture,
-                (self.size * self.textureScale,
-                 self.size * self.textureScale * texAspectRatio)
-            )
-        except FileNotFoundError:
-            print(f"Error loading texture from path \"{texturePath}\"")
-            self.texture = None
+        # Atlas holding car textures and their rotations, shared between cars
+        self.spriteAtlas = spriteAtlas if spriteAtlas is not None else sharedSpriteAtlas
+
+        # Car textures (and their keys in the atlas), only loaded when
+        # rendering is needed
+        self.texture = None
+        self.textureKey: TextureKey | None = None
+        self.wheelTexture = None
+        self.wheelTextureKey: TextureKey | None = None
+
+        # Headless cars never get drawn, so skip loading textures from disk
+        if not loadTextures:
+            return
+
+        # Try loading body texture, resized based on car size
+        self.textureKey = self.spriteAtlas.loadTexture(texturePath, self.size * self.textureScale, textureOffsetAngle)
+        if self.textureKey is not None:
+            self.texture = self.spriteAtlas.texture(self.textureKey)
 
         # Try to load wheel texture
-        try:
-            # Load
-            self.wheelTexture = pygame.image.load("img/wheel.png")
-            # Resize
-            texSize = Vector2(self.wheelTexture.get_size())
-            texAspectRatio = texSize.y / texSize.x
-            self.wheelTexture = pygame.transform.scale(
-                self.wheelTexture,
-                (self.size * WHEEL_SIZE_RATIO,
-                 self.size * WHEEL_SIZE_RATIO * texAspectRatio)
-            )
-        except FileNotFoundError:
-            print(f"Failed loading wheel texture from path \"img/wheel.png\"")
-            self.wheelTexture = None
+        self.wheelTextureKey = self.spriteAtlas.loadTexture("img/wheel.png", self.size * WHEEL_SIZE_RATIO)
+        if self.wheelTextureKey is not None:
+            self.wheelTexture = self.spriteAtlas.texture(self.wheelTextureKey)
 
     # Set car steering
     def setSteering(self, steering: float) -> None:
@@ -152,6 +195,10 @@ class Car:
     def verticalWheelDist(self) -> float:
         return self.size * self.wheelAxisAspectRatio
 
+    # Radius of the circle around the car position that contains all wheels
+    def boundingRadius(self) -> float:
+        return math.hypot(self.verticalWheelDist(), self.horizontalWheelDist()) / 2
+
     def maxSteeringAngle(self) -> float:
         return MAX_STEERING_ANGLE + (MIN_STEERING_ANGLE - MAX_STEERING_ANGLE) * (self.velocity / MAX_VELOCITY)**2
 
@@ -179,6 +226,26 @@ class Car:
         halfY = self.horizontalWheelDist() / 2
         return self.pos + utils.rotatePointAroundPivot(Vector2(-halfX, halfY), Vector2(0, 0), self.rotation)
 
+    # Keeps current position and rotation as the previous ones. Needs to be
+    # called before each update for drawing with interpolation
+    def savePreviousState(self) -> None:
+        self.prevPos = self.pos.copy()
+        self.prevRotation = self.rotation
+
+    # Position between previous (alpha 0) and current (alpha 1) position
+    def interpolatedPos(self, alpha: float) -> Vector2:
+        if alpha >= 1:
+            return self.pos
+        return self.prevPos.lerp(self.pos, alpha)
+
+    # Rotation between previous (alpha 0) and current (alpha 1) rotation,
+    # turning the shortest way
+    def interpolatedRotation(self, alpha: float) -> float:
+        if alpha >= 1:
+            return self.rotation
+        diff = (self.rotation - self.prevRotation + math.pi) % (2 * math.pi) - math.pi
+        return self.prevRotation + diff * alpha
+
     def update(self, dt: float) -> None:
         # Lerp steering towards targetSteering
         self.steering = utils.lerp(self.steering, self.targetSteering, STEERING_LERP_SPEED * dt)
@@ -229,22 +296,27 @@ class Car:
         self.pos = utils.rotatePointAroundPivot(self.pos, pivotCenter, rotationAngle)
         self.rotation = utils.normalizeAngle(self.rotation + rotationAngle)
 
-    def draw(self, surface: pygame.Surface, offset: Vector2=Vector2(0, 0), debug: bool=False) -> None:
+    # Draws the car. With [alpha] below 1, the car is drawn between its
+    # previous state (alpha 0) and its current one (alpha 1)
+    def draw(self, surface: pygame.Surface, offset: Vector2=Vector2(0, 0), debug: bool=False, alpha: float=1) -> None:
+        pos = self.interpolatedPos(alpha)
+        rotation = self.interpolatedRotation(alpha)
+
         # Get wheel distances
         halfX = self.verticalWheelDist() / 2
         halfY = self.horizontalWheelDist() / 2
         wheelSize = self.size * WHEEL_SIZE_RATIO
 
         # Wheel positions
-        frontLeft = self.frontLeftWheelPos()
-        frontRight = self.frontRightWheelPos()
-        backLeft = self.backLeftWheelPos()
-        backRight = self.backRightWheelPos()
+        frontLeft = pos + utils.rotatePointAroundPivot(Vector2(halfX, -halfY), Vector2(0, 0), rotation)
+        frontRight = pos + utils.rotatePointAroundPivot(Vector2(halfX, halfY), Vector2(0, 0), rotation)
+        backLeft = pos + utils.rotatePointAroundPivot(Vector2(-halfX, -halfY), Vector2(0, 0), rotation)
+        backRight = pos + utils.rotatePointAroundPivot(Vector2(-halfX, halfY), Vector2(0, 0), rotation)
 
         # Check if has wheel texture
         if self.wheelTexture != None:
-            # Rotate
-            rotated = pygame.transform.rotate(self.wheelTexture, math.degrees(-self.rotation + math.pi * 0.5 - self.steering * MAX_STEERING_ANGLE))
+            # Rotate (rotations are shared between all cars)
+            rotated = self.spriteAtlas.rotated(self.wheelTextureKey, math.degrees(-rotation + math.pi * 0.5 - self.steering * MAX_STEERING_ANGLE))
 
             # Left wheel
             # ----------
@@ -258,10 +330,10 @@ class Car:
 
         # Check if has body texture
         if self.texture != None:
-            # Rotate
-            rotated = pygame.transform.rotate(self.texture, math.degrees(-self.rotation))
+            # Rotate (rotations are shared between all cars)
+            rotated = self.spriteAtlas.rotated(self.textureKey, math.degrees(-rotation))
             # Position in center
-            rect = rotated.get_rect(center = self.texture.get_rect(center = self.pos + offset).center)
+            rect = rotated.get_rect(center = self.texture.get_rect(center = pos + offset).center)
             surface.blit(rotated, rect)
 
         if debug:
@@ -280,19 +352,19 @@ class Car:
             pygame.draw.line(surface, DEBUG_CHASSIS_OUTLINE_COLOR, backRight + offset, backLeft + offset)
 
             # Arrow pointing in car direction
-            direc = utils.directionVector(self.rotation)
-            utils.drawArrow(surface, self.pos + offset, self.pos + offset + direc * 75, DEBUG_DIRECTION_ARROW_COLOR)
+            direc = utils.directionVector(rotation)
+            utils.drawArrow(surface, pos + offset, pos + offset + direc * 75, DEBUG_DIRECTION_ARROW_COLOR)
 
             # Wheel path trajectory
             # ---------------------
             if abs(self.steering) < 0.01: return
 
-            carDirection = utils.directionVector(self.rotation)
+            carDirection = utils.directionVector(rotation)
             directionNormal = Vector2(-carDirection.y, carDirection.x)
             verticalWheelDist = self.verticalWheelDist()
             pivotSideDist = math.tan(self.wheelAngle()) * verticalWheelDist / 2
             totalDist = self.horizontalWheelDist() * utils.sign(pivotSideDist) / 2 + pivotSideDist
-            pivotCenter = self.pos \
+            pivotCenter = pos \
                         - carDirection * verticalWheelDist / 2 \
                         + directionNormal * totalDist
             pygame.draw.circle(surface, DEBUG_FRONT_WHEEL_PATH_COLOR, pivotCenter + offset, (frontLeft - pivotCenter).length(), 1)
@@ -301,4 +373,4 @@ class Car:
             pygame.draw.circle(surface, DEBUG_BACK_WHEEL_PATH_COLOR, pivotCenter + offset, (backRight - pivotCenter).length(), 1)
 
             # Arrow pointing to pivot center
-            utils.drawArrow(surface, self.pos + offset, pivotCenter + offset, DEBUG_DIRECTION_NORMAL_ARROW_COLOR)
\ No newline at end of file
+            utils.drawArrow(surface, pos + offset, pivotCenter + offset, DEBUG_DIRECTION_NORMAL_ARROW_COLOR)
\ No newline at end of file
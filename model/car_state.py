@@ -0,0 +1,183 @@
+import math
+import numpy as np
+from pygame.math import Vector2
+from model.car import (
+    Car,
+    MAX_STEERING_ANGLE,
+    MIN_STEERING_ANGLE,
+    MAX_VELOCITY,
+    WHEEL_GROUND_FRICTION,
+    STEERING_LERP_SPEED,
+)
+
+# Initial number of cars a store has room for
+INITIAL_CAPACITY = 64
+
+# Car state fields kept as one value per car, and their array types.
+#
+# NOTE: [size] and [wheelAxisAspectRatio] never change after a car is
+# created, so they are only copied when the car is added and the car keeps
+# them as regular attributes
+SCALAR_FIELDS: dict[str, type] = {
+    "accelerationAmount": np.float64,
+    "brakeAmount": np.float64,
+    "reverse": np.bool_,
+    "steering": np.float64,
+    "targetSteering": np.float64,
+    "velocity": np.float64,
+    "rotation": np.float64,
+    "accelerationSpeed": np.float64,
+    "brakeForce": np.float64,
+    "size": np.float64,
+    "wheelAxisAspectRatio": np.float64,
+}
+
+# Structure-of-arrays storage for the state of many cars, so all of them can
+# be updated in a single vectorized pass
+class CarStateStore:
+    def __init__(self, capacity: int = INITIAL_CAPACITY) -> None:
+        # Number of cars in the store
+        self.count = 0
+
+        # Car positions, one (x, y) row per car
+        self.pos = np.zeros((capacity, 2))
+
+        # Scalar state arrays, one attribute per field in SCALAR_FIELDS
+        for name, dtype in SCALAR_FIELDS.items():
+            setattr(self, name, np.zeros(capacity, dtype))
+
+    # Number of cars the store currently has room for
+    def capacity(self) -> int:
+        return len(self.pos)
+
+    # Doubles store capacity, keeping current state
+    def grow(self) -> None:
+        newCapacity = self.capacity() * 2
+        pos = np.zeros((newCapacity, 2))
+        pos[:self.count] = self.pos[:self.count]
+        self.pos = pos
+
+        for name, dtype in SCALAR_FIELDS.items():
+            array = np.zeros(newCapacity, dtype)
+            array[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, array)
+
+    # Moves a car's state into the store, turning the car into a view
+    def add(self, car: Car) -> int:
+        if self.count == self.capacity():
+            self.grow()
+
+        index = self.count
+        self.count += 1
+
+        # Copy current state before binding, since binding changes where
+        # the car reads its state from
+        self.pos[index] = (car.pos.x, car.pos.y)
+        for name in SCALAR_FIELDS:
+            getattr(self, name)[index] = getattr(car, name)
+
+        car.stateStore = self
+        car.stateIndex = index
+        return index
+
+    # Returns the value of a car state field
+    def get(self, name: str, index: int):
+        if name == "pos":
+            x, y = self.pos[index].tolist()
+            return Vector2(x, y)
+        return getattr(self, name)[index].item()
+
+    # Sets the value of a car state field
+    def set(self, name: str, index: int, value) -> None:
+        if name == "pos":
+            self.pos[index] = (value[0], value[1])
+        else:
+            getattr(self, name)[index] = value
+
+    # Updates all cars at once, with the same physics as Car.update
+    def update(self, dt: float) -> None:
+        n = self.count
+        if n == 0:
+            return
+
+        pos = self.pos[:n]
+        rotation = self.rotation[:n]
+        steering = self.steering[:n]
+        velocity = self.velocity[:n]
+
+        # Lerp steering towards targetSteering
+        steering += (self.targetSteering[:n] - steering) * (STEERING_LERP_SPEED * dt)
+
+        # Update velocity
+        # ---------------
+        # Decrease velocity based on wheel friction
+        velocity[:] = np.where(
+            velocity > 0,
+            np.maximum(0, velocity - WHEEL_GROUND_FRICTION * dt),
+            np.minimum(0, velocity + WHEEL_GROUND_FRICTION * dt),
+        )
+
+        # Increase velocity based on how much acceleration
+        direction = np.where(self.reverse[:n], -1.0, 1.0)
+        velocity[:] = np.clip(
+            velocity + self.accelerationSpeed[:n] * self.accelerationAmount[:n] * direction * dt,
+            -MAX_VELOCITY,
+            MAX_VELOCITY,
+        )
+
+        # Decrease velocity based on how much braking
+        braking = self.brakeForce[:n] * self.brakeAmount[:n] * dt
+        velocity[:] = np.where(
+            velocity > 0,
+            np.maximum(0, velocity - braking),
+            np.minimum(0, velocity + braking),
+        )
+
+        cos = np.cos(rotation)
+        sin = np.sin(rotation)
+
+        # Cars with almost no steering move forward without rotation pivot
+        straight = np.abs(steering) < 0.01
+        pos[straight, 0] += cos[straight] * velocity[straight] * dt
+        pos[straight, 1] += sin[straight] * velocity[straight] * dt
+
+        # Remaining cars rotate around a pivot
+        turning = ~straight
+        if not turning.any():
+            return
+
+        tPos = pos[turning]
+        tRotation = rotation[turning]
+        tVelocity = velocity[turning]
+        tCos = cos[turning]
+        tSin = sin[turning]
+
+        # Find rotation pivot
+        size = self.size[:n][turning]
+        verticalWheelDist = size * self.wheelAxisAspectRatio[:n][turning]
+        maxSteeringAngle = MAX_STEERING_ANGLE + (MIN_STEERING_ANGLE - MAX_STEERING_ANGLE) * (tVelocity / MAX_VELOCITY)**2
+        wheelAngle = math.pi * 0.5 - steering[turning] * maxSteeringAngle
+        pivotSideDist = np.tan(-wheelAngle) * verticalWheelDist / 2
+        totalDist = size * np.sign(pivotSideDist) / 2 + pivotSideDist
+        pivotX = tPos[:, 0] - tCos * verticalWheelDist / 2 + tSin * totalDist
+        pivotY = tPos[:, 1] - tSin * verticalWheelDist / 2 - tCos * totalDist
+
+        # Calculate rotation angle
+        rotationAngle = -tVelocity * dt / totalDist
+
+        # Rotate current position around pivot
+        s = np.sin(rotationAngle)
+        c = np.cos(rotationAngle)
+        x = tPos[:, 0] - pivotX
+        y = tPos[:, 1] - pivotY
+        tPos[:, 0] = x * c - y * s + pivotX
+        tPos[:, 1] = x * s + y * c + pivotY
+        pos[turning] = tPos
+
+        # Put new rotation in the 0-2pi range
+        tRotation = tRotation + rotationAngle
+        while (tRotation < 0).any():
+            tRotation = np.where(tRotation < 0, tRotation + math.pi * 2, tRotation)
+        while (tRotation >= math.pi * 2).any():
+            tRotation = np.where(tRotation >= math.pi * 2, tRotation - math.pi * 2, tRotation)
+        rotation[turning] = tRotation
@@ -5,9 +5,15 @@ import pygame
 from pygame.math import Vector2
 import utils
 import math
-from random import randint
+import random
+import time
 from model.car import Car
 from model.path import Path
+from model.route_cache import RouteCache
+import numpy as np
+from model import perception
+from model.spatial_grid import SpatialGrid
+from model.profiler import SimProfiler
 
 # Number of rays the driver "shoots" to detect traffic entities
 DRIVER_VIEW_NUM_RAYS = 25
@@ -15,12 +21,22 @@ DRIVER_VIEW_NUM_RAYS = 25
 # How spread are the rays the driver shoots
 DRIVER_VIEW_RAY_SPREAD = math.pi * .667
 
+# How far the rays the driver shoots reach
+DRIVER_VIEW_DISTANCE = 1500
+
+# Angle of each ray relative to the first one
+RAY_ANGLE_STEPS = np.arange(DRIVER_VIEW_NUM_RAYS) * (DRIVER_VIEW_RAY_SPREAD / DRIVER_VIEW_NUM_RAYS)
+
 # Class that represents a driver inside a car
 class Driver:
-    def __init__(self, car: Car, desiredVelocity: float = 70) -> None:
+    def __init__(self, car: Car, desiredVelocity: float = 70, rng: random.Random | None = None) -> None:
         # Reference to the driver's car
         self.car = car
 
+        # Random generator for picking destinations. Drivers of a simulation
+        # share the simulation's generator, so runs can be reproduced
+        self.rng = rng if rng is not None else random.Random()
+
         # How fast the driver wants the car to be
         self.desiredVelocity = desiredVelocity
 
@@ -33,21 +49,20 @@ class Driver:
         # Driver's current node index in path
         self.pathNodeIndex: int | None = None
 
-    def newPath(
-        self,
-        startPoint: Vector2,
-        points: list[Vector2],
-        nodesGraph: dict[str, list[Vector2]],
-    ) -> None:
+    # Whether the driver has no path, or already reached the end of it
+    def needsNewPath(self) -> bool:
+        return self.path == None or self.pathNodeIndex >= len(self.path) - 1
+
+    def newPath(self, startNode: int, routeCache: RouteCache) -> None:
         # Clear current path and generate new one which starts on current position
         self.path = None
+        pointIds = routeCache.roadGraph.pointIdsList
         while self.path == None or len(self.path) < 2:
-            endIndex = randint(0, len(points) - 1)
-            endPoint = points[endIndex]
-            self.path = utils.A_Star(nodesGraph, startPoint, endPoint)
+            endIndex = self.rng.randint(0, len(pointIds) - 1)
+            endNode = pointIds[endIndex]
 
-        # Apply smooth path curves
-        self.path = utils.smoothPathCurves(self.path)
+            # NOTE: Paths from the route cache already have smooth curves
+            self.path = routeCache.findPath(startNode, endNode)
 
         # Reset path index
         self.pathNodeIndex = 0
@@ -68,42 +83,58 @@ class Driver:
         self,
         dt: float,
         drivers: list[Driver],
-        points: list[Vector2],
-        nodesGraph: dict[str, list[Vector2]],
+        routeCache: RouteCache,
+        driverGrid: SpatialGrid | None = None,
+        updateCar: bool = True,
+        profiler: SimProfiler | None = None,
+        startNode: int | None = None,
     ) -> None:
         # TODO: Set car stats based on info such as:
         # - Cars in front
         # - Current path trajectory
         # - Traffic lights
 
+        # Time each phase, if profiling
+        if profiler is not None:
+            t = time.perf_counter_ns()
+
         # If no path or already at the end of current path, set new path
-        if self.path == None or self.pathNodeIndex >= len(self.path) - 1:
-            # Find closest node to car's current position
-            dist = 1e10
-            closest = None
-            for point in points:
-                d = (point - self.car.pos).magnitude()
-                if d < dist:
-                    closest = point.copy()
-                    dist = d
+        if self.needsNewPath():
+            # Find closest node to car's current position, unless it was
+            # already found
+            if startNode is None:
+                startNode = routeCache.roadGraph.closestNode(self.car.pos)
 
             # Generate new path
-            self.newPath(closest, points, nodesGraph)
+            self.newPath(startNode, routeCache)
+            if profiler is not None:
+                profiler.count("newPaths")
+                t = profiler.lap("newPath", t)
 
         # Check path status
         self.traversePath()
-
-        # Check if there's any car in front
-        self.checkCarCollisions(drivers)
-
-        # Update car
-        self.car.update(dt)
-
-    def draw(self, surface: pygame.Surface, offset: Vector2 = Vector2(0, 0), debug: bool = False) -> None:
+        if profiler is not None:
+            t = profiler.lap("traversePath", t)
+
+        # Check if there's any car in front, only looking at nearby cars if
+        # a spatial grid is available
+        if driverGrid is not None:
+            drivers = self.nearbyDrivers(driverGrid)
+        self.checkCarCollisions(drivers, profiler)
+        if profiler is not None:
+            t = profiler.lap("perception", t)
+
+        # Update car, unless its physics are updated in batch by a CarStateStore
+        if updateCar:
+            self.car.update(dt)
+            if profiler is not None:
+                profiler.lap("physics", t)
+
+    def draw(self, surface: pygame.Surface, offset: Vector2 = Vector2(0, 0), debug: bool = False, alpha: float = 1) -> None:
         if self.path != None and debug:
             for point in self.path:
                 pygame.draw.circle(surface, (255, 127, 0), point + offset, 5)
-        self.car.draw(surface, offset, debug)
+        self.car.draw(surface, offset, debug, alpha)
 
     def adjustToAppropriateSpeed(self) -> None:
         if self.car.velocity < self.appropriateVelocity:
@@ -111,81 +142,161 @@ class Driver:
         else:
             self.setBrakeAmount(0.5)
 
-    def checkCarCollisions(self, drivers: list[Driver]) -> None:
+    # Start position of the rays the driver shoots (car's front)
+    def viewOrigin(self) -> Vector2:
+        return self.car.pos + utils.directionVector(self.car.rotation) * self.car.size
+
+    # Axis-aligned bounding box (minX, minY, maxX, maxY) of the driver's view cone
+    def viewBounds(self) -> tuple[float, float, float, float]:
+        origin = self.viewOrigin()
+        startAngle = self.car.rotation - DRIVER_VIEW_RAY_SPREAD / 2
+        endAngle = self.car.rotation + DRIVER_VIEW_RAY_SPREAD / 2
+
+        # Cone tip and both cone edges
+        xs = [origin.x]
+        ys = [origin.y]
+        for angle in (startAngle, endAngle):
+            xs.append(origin.x + math.cos(angle) * DRIVER_VIEW_DISTANCE)
+            ys.append(origin.y + math.sin(angle) * DRIVER_VIEW_DISTANCE)
+
+        # Arc extremes, where the cone crosses an axis direction
+        k = math.ceil(startAngle / (math.pi / 2))
+        while k * math.pi / 2 <= endAngle:
+            angle = k * math.pi / 2
+            xs.append(origin.x + math.cos(angle) * DRIVER_VIEW_DISTANCE)
+            ys.append(origin.y + math.sin(angle) * DRIVER_VIEW_DISTANCE)
+            k += 1
+
+        return min(xs), min(ys), max(xs), max(ys)
+
+    # Returns drivers whose cars can be hit by this driver's view rays
+    def nearbyDrivers(self, driverGrid: SpatialGrid) -> list[Driver]:
+        origin = self.viewOrigin()
+        candidates = [
+            driver for driver in driverGrid.query(*self.viewBounds())
+            if driver is not self
+        ]
+
+        store = self.car.stateStore
+        if store is not None:
+            # Car states are already in arrays, filter them all at once
+            indices = np.array([driver.car.stateIndex for driver in candidates], dtype=int)
+            sizes = store.size[indices]
+            maxDist = DRIVER_VIEW_DISTANCE + np.hypot(sizes * store.wheelAxisAspectRatio[indices], sizes) / 2
+            offsets = store.pos[indices] - (origin.x, origin.y)
+            inView = (offsets * offsets).sum(axis=1) <= maxDist * maxDist
+            return [driver for driver, keep in zip(candidates, inView.tolist()) if keep]
+
+        nearby: list[Driver] = []
+        for driver in candidates:
+            # Discard cars out of view distance
+            maxDist = DRIVER_VIEW_DISTANCE + driver.car.boundingRadius()
+            if origin.distance_squared_to(driver.car.pos) <= maxDist * maxDist:
+                nearby.append(driver)
+
+        return nearby
+
+    # Slows down for cars in front of this driver's car. With a [profiler],
+    # the number of ray tests (one per ray and box side) and hits is counted
+    def checkCarCollisions(self, drivers: list[Driver], profiler: SimProfiler | None = None) -> None:
         myCar = self.car
-        for driver in drivers:
-            if driver == self:
-                continue
+        store = myCar.stateStore
 
-            # Check if car is in front of this car for at least 50 units
-            # ----------------------------------------------------------
-            otherCar = driver.car
+        # Find cars that can possibly be in front of this car
+        # ---------------------------------------------------
+        otherCars: list[Car] = []
+        if store is not None:
+            # Car states are already in arrays, filter them all at once
+            others = [driver.car for driver in drivers if driver != self]
+            indices = np.array([car.stateIndex for car in others], dtype=int)
 
             # Check if this car and other car are both in similar direction
-            # NOTE: This check prevents unnecessary braking when seeing cars coming the other way
-            angleDiff = myCar.rotation - otherCar.rotation
-            while angleDiff > 2 * math.pi:
-                angleDiff -= 2 * math.pi
-            while angleDiff < -2 * math.pi:
-                angleDiff += 2 * math.pi
-            if abs(angleDiff) > math.pi / 2:
-                continue
-
-            # Because the car can be considered as a box, check collision for
-            # each one of the 4 sides
-            points: list[Vector2] = [
-                otherCar.backLeftWheelPos(),
-                otherCar.backRightWheelPos(),
-                otherCar.frontRightWheelPos(),
-                otherCar.frontLeftWheelPos(),
-            ]
-            numPoints = len(points)
+            # NOTE: Rotations are always in the 0-2pi range, so the difference
+            # is already in the (-2pi, 2pi) range
+            similar = np.abs(myCar.rotation - store.rotation[indices]) <= math.pi / 2
+            otherCars = [car for car, keep in zip(others, similar.tolist()) if keep]
+            indices = indices[similar]
+        else:
+            for driver in drivers:
+                if driver == self:
+                    continue
+
+                otherCar = driver.car
+
+                # Check if this car and other car are both in similar direction
+                # NOTE: This check prevents unnecessary braking when seeing cars coming the other way
+                angleDiff = myCar.rotation - otherCar.rotation
+                while angleDiff > 2 * math.pi:
+                    angleDiff -= 2 * math.pi
+                while angleDiff < -2 * math.pi:
+                    angleDiff += 2 * math.pi
+                if abs(angleDiff) > math.pi / 2:
+                    continue
+
+                otherCars.append(otherCar)
+
+        # Whether any car in front is close enough to slow down for
+        carAhead = False
+        if len(otherCars) > 0:
+            # Because each car can be considered as a box, cast all rays
+            # against the 4 sides of all boxes at once
+            # ----------------------------------------------------------
+            if store is not None:
+                sizes = store.size[indices]
+                corners = perception.boxCorners(
+                    store.pos[indices],
+                    store.rotation[indices],
+                    sizes * store.wheelAxisAspectRatio[indices] / 2,
+                    sizes / 2,
+                )
+            else:
+                corners = perception.boxCorners(
+                    np.array([(car.pos.x, car.pos.y) for car in otherCars]),
+                    np.array([car.rotation for car in otherCars]),
+                    np.array([car.verticalWheelDist() / 2 for car in otherCars]),
+                    np.array([car.horizontalWheelDist() / 2 for car in otherCars]),
+                )
 
             # Raycast start is this car's front
-            lineStart = myCar.pos + \
-                utils.directionVector(myCar.rotation) * myCar.size
-
-            # Ray angle step
-            angleStep = DRIVER_VIEW_RAY_SPREAD / DRIVER_VIEW_NUM_RAYS
-
-            # Get minimum distance
-            minDistance = 1e6
-            for i in range(DRIVER_VIEW_NUM_RAYS):
-                # Calculate new angle
-                angle = myCar.rotation - DRIVER_VIEW_RAY_SPREAD / 2 + i * angleStep
-                lineEnd = lineStart + utils.directionVector(angle) * 1500
-
-                for j in range(numPoints):
-                    p1 = points[j % numPoints]
-                    p2 = points[(j + 1) % numPoints]
-
-                    # Get intersection point
-                    intersec = utils.lineLineIntersection(
-                        lineStart, lineEnd, p1, p2)
-                    if intersec == None:
-                        continue
-
-                    # Update min distance
-                    dist = (lineStart - intersec).length()
-                    if dist < minDistance:
-                        minDistance = dist
-
-            # Check if distance is too close
-            actualDistance = minDistance - otherCar.size * otherCar.wheelAxisAspectRatio
-            if actualDistance < 150:
-                # Interpolate appropriate velocity towards the other car's velocity
-                self.appropriateVelocity = utils.lerp(
-                    self.appropriateVelocity, otherCar.velocity, 0.05)
-
-                if actualDistance < 60 and otherCar.velocity != 0 and self.appropriateVelocity / otherCar.velocity > 1:
-                    # Brake based on how close from the other car we are
-                    # The closer, the more is needed to brake
-                    self.setBrakeAmount((60 - actualDistance) / 250)
-                    self.setAccelerationAmount(0)
-            else:
-                # Interpolate appropriate velocity towards desired velocity
-                self.appropriateVelocity = utils.lerp(
-                    self.appropriateVelocity, self.desiredVelocity, 0.01)
+            lineStart = self.viewOrigin()
+
+            # Ray directions
+            angles = myCar.rotation - DRIVER_VIEW_RAY_SPREAD / 2 + RAY_ANGLE_STEPS
+            directions = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+            # Get minimum distance to each car
+            minDistances, numIntersections = perception.raysBoxesMinDistance(
+                np.array((lineStart.x, lineStart.y)),
+                directions,
+                DRIVER_VIEW_DISTANCE,
+                corners,
+            )
+            if profiler is not None:
+                profiler.count("rayTests", len(directions) * len(otherCars) * 4)
+                profiler.count("rayIntersections", numIntersections)
+
+            for otherCar, minDistance in zip(otherCars, minDistances.tolist()):
+                # Check if distance is too close
+                actualDistance = minDistance - otherCar.size * otherCar.wheelAxisAspectRatio
+                if actualDistance < 150:
+                    carAhead = True
+
+                    # Interpolate appropriate velocity towards the other car's velocity
+                    self.appropriateVelocity = utils.lerp(
+                        self.appropriateVelocity, otherCar.velocity, 0.05)
+
+                    if actualDistance < 60 and otherCar.velocity != 0 and self.appropriateVelocity / otherCar.velocity > 1:
+                        # Brake based on how close from the other car we are
+                        # The closer, the more is needed to brake
+                        self.setBrakeAmount((60 - actualDistance) / 250)
+                        self.setAccelerationAmount(0)
+
+        # NOTE: This used to be done once for every car not in front, which
+        # made drivers recover faster the more cars were in the simulation
+        if not carAhead:
+            # Interpolate appropriate velocity towards desired velocity
+            self.appropriateVelocity = utils.lerp(
+                self.appropriateVelocity, self.desiredVelocity, 0.01)
 
     def traversePath(self) -> None:
         if self.path == None or self.pathNodeIndex == None:
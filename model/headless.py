@@ -0,0 +1,72 @@
+import time
+from model.traffic_sim import TrafficSim, ROAD_WIDTH, CURVE_ARC_OFFSET, DESIRED_VELOCITY_RANGE
+from model.profiler import SimProfiler
+
+# Default fixed time step for headless runs (same as a 60 fps app)
+DEFAULT_DT = 1 / 60
+
+# Runs a traffic simulation without any window or rendering, as fast as possible
+class HeadlessSimulation:
+    def __init__(
+        self,
+        roadMapFilePath: str,
+        numCars: int,
+        roadWidth: float = ROAD_WIDTH,
+        curveArcOffset: float = CURVE_ARC_OFFSET,
+        seed: int | None = None,
+        profile: bool = False,
+        desiredVelocityRange: tuple[int, int] = DESIRED_VELOCITY_RANGE,
+    ) -> None:
+        # Traffic simulation, with no textures loaded
+        self.trafficSim = TrafficSim(
+            roadWidth,
+            curveArcOffset,
+            roadMapFilePath,
+            numCars,
+            headless=True,
+            seed=seed,
+            profiler=SimProfiler() if profile else None,
+            desiredVelocityRange=desiredVelocityRange,
+        )
+
+        # How many ticks were simulated so far
+        self.ticks = 0
+
+        # Total simulated time, in seconds
+        self.simTime = 0.0
+
+        # Total wall-clock time spent updating the simulation, in seconds
+        self.wallTime = 0.0
+
+    # Steps the simulation [numTicks] times with a fixed [dt]
+    def run(self, numTicks: int, dt: float = DEFAULT_DT) -> dict:
+        assert numTicks >= 0, "Number of ticks can't be negative"
+        assert dt > 0, "Time step must be positive"
+
+        update = self.trafficSim.update
+        start = time.perf_counter()
+        for _ in range(numTicks):
+            update(dt)
+        elapsed = time.perf_counter() - start
+
+        self.ticks += numTicks
+        self.simTime += numTicks * dt
+        self.wallTime += elapsed
+
+        return self.stats()
+
+    # Returns run statistics so far, with profiling statistics if enabled
+    def stats(self) -> dict:
+        stats = {
+            "ticks": self.ticks,
+            "cars": len(self.trafficSim.drivers),
+            "simTime": self.simTime,
+            "wallTime": self.wallTime,
+            "ticksPerSecond": self.ticks / self.wallTime if self.wallTime > 0 else 0.0,
+            "speedup": self.simTime / self.wallTime if self.wallTime > 0 else 0.0,
+            "seed": self.trafficSim.seed,
+            "stateHash": self.trafficSim.stateHash(),
+        }
+        if self.trafficSim.profiler is not None:
+            stats["profile"] = self.trafficSim.profiler.stats()
+        return stats
@@ -0,0 +1,96 @@
+import math
+import numpy as np
+
+# Average number of nodes per grid cell the index aims for
+NODES_PER_CELL = 4
+
+# Static index for closest node queries over a fixed set of nodes.
+#
+# Nodes are bucketed once in a uniform grid covering their bounding box.
+# Queries check the cell the position falls in first, and then rings of cells
+# around it, stopping as soon as no cell left can hold a closer node. Ties are
+# resolved to the lowest node id, same as scanning every node
+class NodeIndex:
+    def __init__(self, nodes: np.ndarray, nodesPerCell: float = NODES_PER_CELL) -> None:
+        assert nodesPerCell > 0, "Nodes per cell must be positive"
+
+        self.numNodes = len(nodes)
+        if self.numNodes > 0:
+            self.minX, self.minY = nodes.min(axis=0).tolist()
+            maxX, maxY = nodes.max(axis=0).tolist()
+        else:
+            self.minX = self.minY = maxX = maxY = 0.0
+
+        # NOTE: Sides are at least 1 unit long, so nodes along a single
+        # horizontal or vertical line still get a sensible cell size
+        width = max(maxX - self.minX, 1)
+        height = max(maxY - self.minY, 1)
+        self.cellSize = math.sqrt(width * height * nodesPerCell / max(self.numNodes, 1))
+        self.gridWidth = int(width // self.cellSize) + 1
+        self.gridHeight = int(height // self.cellSize) + 1
+
+        # Node coordinates, as plain lists since queries read them one at a time
+        self.xs: list[float] = nodes[:, 0].tolist() if self.numNodes > 0 else []
+        self.ys: list[float] = nodes[:, 1].tolist() if self.numNodes > 0 else []
+
+        # Node ids in each cell (in increasing order), indexed by
+        # j * gridWidth + i
+        self.cells: list[list[int]] = [[] for _ in range(self.gridWidth * self.gridHeight)]
+        for nodeId, (x, y) in enumerate(zip(self.xs, self.ys)):
+            i, j = self.cellIndex(x, y)
+            self.cells[j * self.gridWidth + i].append(nodeId)
+
+    # Returns the cell index for a given position, clamped to the grid
+    def cellIndex(self, x: float, y: float) -> tuple[int, int]:
+        i = math.floor((x - self.minX) / self.cellSize)
+        j = math.floor((y - self.minY) / self.cellSize)
+        return min(max(i, 0), self.gridWidth - 1), min(max(j, 0), self.gridHeight - 1)
+
+    # Returns id of the node closest to a given position
+    def closest(self, x: float, y: float) -> int:
+        assert self.numNodes > 0, "Can't find closest node without nodes"
+
+        xs, ys, cells = self.xs, self.ys, self.cells
+        gridWidth, gridHeight, cellSize = self.gridWidth, self.gridHeight, self.cellSize
+        ci, cj = self.cellIndex(x, y)
+
+        best = -1
+        bestDist = math.inf
+        for r in range(max(ci, gridWidth - 1 - ci, cj, gridHeight - 1 - cj) + 1):
+            i0, i1 = max(ci - r, 0), min(ci + r, gridWidth - 1)
+            for j in range(max(cj - r, 0), min(cj + r, gridHeight - 1) + 1):
+                # Only cells on the ring border, inner ones were already checked
+                if j == cj - r or j == cj + r:
+                    ring = range(i0, i1 + 1)
+                else:
+                    ring = [i for i in (ci - r, ci + r) if 0 <= i < gridWidth]
+
+                for i in ring:
+                    for nodeId in cells[j * gridWidth + i]:
+                        dx = xs[nodeId] - x
+                        dy = ys[nodeId] - y
+                        dist = dx * dx + dy * dy
+                        if dist < bestDist or (dist == bestDist and nodeId < best):
+                            best = nodeId
+                            bestDist = dist
+
+            # Closest distance a node outside of the checked cells can be at.
+            # Sides on the grid's border have nothing beyond them
+            bound = math.inf
+            if ci - r > 0:
+                bound = min(bound, x - (self.minX + (ci - r) * cellSize))
+            if ci + r < gridWidth - 1:
+                bound = min(bound, self.minX + (ci + r + 1) * cellSize - x)
+            if cj - r > 0:
+                bound = min(bound, y - (self.minY + (cj - r) * cellSize))
+            if cj + r < gridHeight - 1:
+                bound = min(bound, self.minY + (cj + r + 1) * cellSize - y)
+            if bound * bound > bestDist:
+                break
+
+        return best
+
+    # Returns ids of the nodes closest to each of the given (x, y) positions
+    def closestMany(self, positions: list[tuple[float, float]]) -> list[int]:
+        closest = self.closest
+        return [closest(x, y) for x, y in positions]
@@ -0,0 +1,82 @@
+import numpy as np
+
+# Distance returned when a ray doesn't hit anything
+NO_HIT_DISTANCE = 1e6
+
+# Calculates corners of boxes given their centers, rotations and half sizes.
+#
+# Box corners are returned in the same order as the car's wheel positions:
+# back left, back right, front right, front left
+#
+# Returns an array with shape (K, 4, 2)
+def boxCorners(
+    centers: np.ndarray,
+    rotations: np.ndarray,
+    halfLengths: np.ndarray,
+    halfWidths: np.ndarray,
+) -> np.ndarray:
+    s = np.sin(rotations)[:, None]
+    c = np.cos(rotations)[:, None]
+
+    # Local corner offsets, before rotation
+    localX = np.stack([-halfLengths, -halfLengths, halfLengths, halfLengths], axis=1)
+    localY = np.stack([-halfWidths, halfWidths, halfWidths, -halfWidths], axis=1)
+
+    # Same rotation as utils.rotatePointAroundPivot
+    corners = np.empty((len(centers), 4, 2))
+    corners[:, :, 0] = centers[:, 0, None] + (localX * c - localY * s)
+    corners[:, :, 1] = centers[:, 1, None] + (localX * s + localY * c)
+    return corners
+
+# Casts rays from a single origin against the edges of K boxes and returns
+# the minimum hit distance for each box (or NO_HIT_DISTANCE if no ray hits
+# it), along with the number of ray/edge intersections found.
+#
+# - [origin] has shape (2,)
+# - [directions] has shape (R, 2), with unit length directions
+# - [corners] has shape (K, 4, 2), see boxCorners
+#
+# Uses the same segment intersection as utils.lineLineIntersection, with
+# the rays being segments from [origin] to [origin] + direction * [length]
+def raysBoxesMinDistance(
+    origin: np.ndarray,
+    directions: np.ndarray,
+    length: float,
+    corners: np.ndarray,
+) -> tuple[np.ndarray, int]:
+    if len(corners) == 0:
+        return np.empty(0), 0
+
+    # Ray segments (p1 -> p2), shape (R, 1, 1)
+    p1x = origin[0]
+    p1y = origin[1]
+    p2x = (origin[0] + directions[:, 0] * length)[:, None, None]
+    p2y = (origin[1] + directions[:, 1] * length)[:, None, None]
+
+    # Box edge segments (p3 -> p4), shape (1, K, 4)
+    p3 = corners[None, :, :, :]
+    p4 = np.roll(corners, -1, axis=1)[None, :, :, :]
+    p3x = p3[..., 0]
+    p3y = p3[..., 1]
+    p4x = p4[..., 0]
+    p4y = p4[..., 1]
+
+    # Shape (R, K, 4) from here on
+    t0 = (p1x - p3x) * (p3y - p4y) - (p1y - p3y) * (p3x - p4x)
+    t1 = (p1x - p2x) * (p3y - p4y) - (p1y - p2y) * (p3x - p4x)
+    u0 = (p1x - p2x) * (p1y - p3y) - (p1y - p2y) * (p1x - p3x)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = t0 / t1
+        u = -u0 / t1
+
+    # Both t and u need to be in [0, 1] range (NaNs from t1 == 0 fail this)
+    hit = (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+
+    # Distance from origin to intersection point
+    dx = p1x - (p1x + (p2x - p1x) * t)
+    dy = p1y - (p1y + (p2y - p1y) * t)
+    dist = np.where(hit, np.sqrt(dx * dx + dy * dy), NO_HIT_DISTANCE)
+
+    # Min over rays and box edges
+    return np.minimum(dist.min(axis=(0, 2)), NO_HIT_DISTANCE), int(np.count_nonzero(hit))
@@ -0,0 +1,139 @@
+import time
+from collections import deque
+
+# Default number of samples kept for rolling statistics (5 seconds at 60 ticks
+# per second)
+DEFAULT_WINDOW_SIZE = 300
+
+# Percentiles reported for each phase
+REPORTED_PERCENTILES = (50, 90, 99)
+
+# Phase for the whole simulation tick
+TICK_PHASE = "tick"
+
+# Opt-in instrumentation for the simulation, with per-phase timers, event
+# counters, and rolling statistics over the last ticks.
+#
+# Timers use perf_counter_ns and are meant to be used as:
+#
+#   t = time.perf_counter_ns()
+#   ...phase 1...
+#   t = profiler.lap("phase1", t)
+#   ...phase 2...
+#   t = profiler.lap("phase2", t)
+#
+# Times and counts are summed during a tick (between beginTick and endTick),
+# and each tick's sums become one sample of the rolling statistics
+class SimProfiler:
+    def __init__(self, windowSize: int = DEFAULT_WINDOW_SIZE) -> None:
+        assert windowSize > 0, "Window size must be positive"
+        self.windowSize = windowSize
+
+        # Time (ns) and counts summed in the current tick, by name
+        self.tickTimes: dict[str, int] = {}
+        self.tickCounts: dict[str, int] = {}
+
+        # Last samples of each phase time (ns) and counter, by name
+        self.timeSamples: dict[str, deque[int]] = {}
+        self.countSamples: dict[str, deque[int]] = {}
+
+        # Totals since the profiler was created (or reset), by name
+        self.totalTimes: dict[str, int] = {}
+        self.totalCounts: dict[str, int] = {}
+
+        # Number of ticks profiled
+        self.ticks = 0
+
+        # Start of the current tick
+        self.tickStart = 0
+
+    # Starts a new tick
+    def beginTick(self) -> None:
+        self.tickTimes.clear()
+        self.tickCounts.clear()
+        self.tickStart = time.perf_counter_ns()
+
+    # Ends current tick, adding its sums to the rolling statistics
+    def endTick(self) -> None:
+        self.tickTimes[TICK_PHASE] = time.perf_counter_ns() - self.tickStart
+        for name, ns in self.tickTimes.items():
+            self.sample(name, ns)
+        for name, count in self.tickCounts.items():
+            self.sampleCount(name, count)
+        self.ticks += 1
+
+    # Adds time since [start] (from perf_counter_ns) to a phase in the current
+    # tick, returning current time so it can start the next phase
+    def lap(self, phase: str, start: int) -> int:
+        now = time.perf_counter_ns()
+        self.tickTimes[phase] = self.tickTimes.get(phase, 0) + now - start
+        return now
+
+    # Adds to a counter in the current tick
+    def count(self, name: str, amount: int = 1) -> None:
+        self.tickCounts[name] = self.tickCounts.get(name, 0) + amount
+
+    # Adds a phase time sample directly, for phases measured outside ticks
+    # (like drawing, which happens once per frame)
+    def sample(self, phase: str, ns: int) -> None:
+        samples = self.timeSamples.get(phase)
+        if samples is None:
+            samples = deque(maxlen=self.windowSize)
+            self.timeSamples[phase] = samples
+        samples.append(ns)
+        self.totalTimes[phase] = self.totalTimes.get(phase, 0) + ns
+
+    # Adds a counter sample directly
+    def sampleCount(self, name: str, count: int) -> None:
+        samples = self.countSamples.get(name)
+        if samples is None:
+            samples = deque(maxlen=self.windowSize)
+            self.countSamples[name] = samples
+        samples.append(count)
+        self.totalCounts[name] = self.totalCounts.get(name, 0) + count
+
+    # Removes all samples and totals
+    def reset(self) -> None:
+        self.tickTimes.clear()
+        self.tickCounts.clear()
+        self.timeSamples.clear()
+        self.countSamples.clear()
+        self.totalTimes.clear()
+        self.totalCounts.clear()
+        self.ticks = 0
+
+    # Returns rolling statistics of each phase (in ms) and counter (per
+    # sample), along with totals, e.g.:
+    #
+    #   {"ticks": 120, "phases": {"tick": {"last": 1.2, "mean": 1.1, "p50": ...}}, "counters": {...}}
+    def stats(self) -> dict:
+        return {
+            "ticks": self.ticks,
+            "phases": {
+                phase: {
+                    **_summary(samples, 1e-6),
+                    "totalMs": self.totalTimes[phase] * 1e-6,
+                }
+                for phase, samples in self.timeSamples.items()
+            },
+            "counters": {
+                name: {
+                    **_summary(samples, 1),
+                    "total": self.totalCounts[name],
+                }
+                for name, samples in self.countSamples.items()
+            },
+        }
+
+# Returns last value, mean and percentiles of some samples, multiplied by [scale]
+def _summary(samples: deque[int], scale: float) -> dict:
+    ordered = sorted(samples)
+    summary = {
+        "last": samples[-1] * scale,
+        "mean": sum(ordered) / len(ordered) * scale,
+    }
+    for p in REPORTED_PERCENTILES:
+        # Nearest-rank percentile
+        index = min(len(ordered) - 1, max(0, -(-p * len(ordered) // 100) - 1))
+        summary[f"p{p}"] = ordered[index] * scale
+    return summary
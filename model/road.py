@@ -1,6 +1,8 @@
 from typing import Callable
 import pygame
 import math
+import json
+import numpy as np
 import utils
 from pygame.math import Vector2
 
@@ -63,6 +65,54 @@ class RoadLine:
         }
 
 
+# Reads road lines from a road map JSON file
+def readRoadLines(filePath: str) -> list[RoadLine]:
+    roadLines: list[RoadLine] = []
+    with open(filePath, "r") as f:
+        lst = json.load(f)
+        for obj in lst:
+            # Multiply all coordinates by 2 to create between-tile spacing
+            roadLines.append(RoadLine(
+                Vector2(
+                    obj["start"]["x"] * 2,
+                    obj["start"]["y"] * 2,
+                ),
+                Vector2(
+                    obj["end"]["x"] * 2,
+                    obj["end"]["y"] * 2,
+                ),
+            ))
+
+    return roadLines
+
+# Creates a tile map with all tiles covered by road lines set to TILE_ROAD
+# and all other tiles set to TILE_EMPTY. Tile (0, 0) is the top left corner of
+# the road lines bounding box.
+#
+# Each line directly marks the tiles it covers, instead of testing every tile
+# against every line. Road lines are axis-aligned, so the tiles a line covers
+# are the ones in its bounding box (same as RoadLine.contains)
+def rasterizeRoadLines(roadLines: list[RoadLine]) -> np.ndarray:
+    if len(roadLines) == 0:
+        return np.zeros((0, 0), dtype=np.uint8)
+
+    minX = int(min(min(line.start.x, line.end.x) for line in roadLines))
+    minY = int(min(min(line.start.y, line.end.y) for line in roadLines))
+    maxX = int(max(max(line.start.x, line.end.x) for line in roadLines))
+    maxY = int(max(max(line.start.y, line.end.y) for line in roadLines))
+    sizeX = maxX - minX + 1
+    sizeY = maxY - minY + 1
+
+    tiles = np.full((sizeY, sizeX), TILE_EMPTY, dtype=np.uint8)
+    for line in roadLines:
+        x0 = math.ceil(min(line.start.x, line.end.x)) - minX
+        x1 = math.floor(max(line.start.x, line.end.x)) - minX
+        y0 = math.ceil(min(line.start.y, line.end.y)) - minY
+        y1 = math.floor(max(line.start.y, line.end.y)) - minY
+        tiles[y0:y1 + 1, x0:x1 + 1] = TILE_ROAD
+
+    return tiles
+
 # Abstract class road
 class Road:
     # Abstract class that defines a road object
@@ -1527,3 +1577,92 @@ def _sortRules(r: tuple[str, Callable]) -> None:
     return rsizeX**2 + rsizeY**2
 
 roadRules.sort(key=_sortRules, reverse=True)
+
+# Version of the road rules. Needs to be increased every time a rule changes
+# what it generates, so road maps compiled with older rules aren't reused
+ROAD_RULES_VERSION = 1
+
+# Tile patterns each rule callback can match, keyed by rule size. Rows are
+# separated by "|", with 1 for TILE_ROAD and 0 for TILE_EMPTY
+roadRulePatterns: dict[str, list[str]] = {
+    '2|2': ["11|10", "11|01", "10|11", "01|11"],
+    '1|2': ["1|0", "0|1"],
+    '2|1': ["10", "01"],
+    '2|3': ["10|11|10", "01|11|01"],
+    '3|2': ["010|111", "111|010"],
+    '3|3': ["010|111|010"],
+    '5|5': ["00100|00100|11111|00100|00100"],
+}
+
+# Converts a tile pattern to a window code, where bit (row * width + column)
+# is set if that tile is a road
+def _patternCode(pattern: str) -> int:
+    code = 0
+    for row, line in enumerate(pattern.split("|")):
+        for column, tile in enumerate(line):
+            if tile == "1":
+                code |= 1 << (row * len(line) + column)
+    return code
+
+# Window codes each rule can match, keyed by rule size
+roadRuleCodes: dict[str, np.ndarray] = {
+    rule: np.array([_patternCode(p) for p in patterns], dtype=np.int64)
+    for rule, patterns in roadRulePatterns.items()
+}
+
+# Returns top left (x, y) of all windows of a given size whose tiles match
+# any of the given codes, in row-major order. [roadTiles] must have True for
+# road tiles and False for all others
+def findRuleWindows(roadTiles: np.ndarray, sizeX: int, sizeY: int, codes: np.ndarray) -> list[tuple[int, int]]:
+    mapSizeY, mapSizeX = roadTiles.shape
+    h = mapSizeY - sizeY + 1
+    w = mapSizeX - sizeX + 1
+    if h <= 0 or w <= 0:
+        return []
+
+    # Code for every window, built one window tile at a time
+    windowCodes = np.zeros((h, w), dtype=np.int64)
+    for row in range(sizeY):
+        for column in range(sizeX):
+            bit = row * sizeX + column
+            windowCodes |= roadTiles[row:row + h, column:column + w].astype(np.int64) << bit
+
+    ys, xs = np.nonzero(np.isin(windowCodes, codes))
+    return list(zip(xs.tolist(), ys.tolist()))
+
+# Applies all road rules to a tile map (as returned by rasterizeRoadLines),
+# filling [nodesGraph] with road point connections.
+#
+# Returns the generated roads, the generated points, and the tile map with
+# the values set by rules
+def applyRoadRules(
+    tiles: np.ndarray,
+    nodesGraph: dict[str, list[Vector2]],
+    roadWidth: float,
+    curveArcOffset: float,
+) -> tuple[list[Road], list[Vector2], list[list[int]]]:
+    mapSizeY, mapSizeX = tiles.shape
+    size = Vector2(mapSizeX, mapSizeY)
+    roadTiles = tiles == TILE_ROAD
+
+    # NOTE: Rules read single tiles a lot, which is much faster on lists
+    tileMap: list[list[int]] = tiles.tolist()
+
+    roads: list[Road] = []
+    points: list[Vector2] = []
+    for rule, callback in roadRules:
+        lines = rule.split("|")
+        sx = int(lines[0])
+        sy = int(lines[1])
+
+        # Rules only turn road tiles into other values, so a window that
+        # doesn't match any pattern on the original tile map never will.
+        # This means only windows matching right now need to be checked,
+        # and the callback itself checks if the window still matches
+        for x, y in findRuleWindows(roadTiles, sx, sy, roadRuleCodes[rule]):
+            # Get new possible roads and points
+            newRoads, newPoints = callback(Vector2(x, y), tileMap, nodesGraph, size, roadWidth, curveArcOffset)
+            roads.extend(newRoads)
+            points.extend(newPoints)
+
+    return roads, points, tileMap
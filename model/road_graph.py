@@ -0,0 +1,120 @@
+# NOTE: This import is needed so a class can reference itself in type annotations
+from __future__ import annotations
+import numpy as np
+from pygame.math import Vector2
+import utils
+from model.node_index import NodeIndex
+
+# Road nodes graph compiled into flat arrays with integer node ids.
+#
+# Outgoing edges of node n are stored in CSR (compressed sparse row) form:
+# targets[offsets[n]:offsets[n + 1]] are the nodes n connects to, and
+# lengths[offsets[n]:offsets[n + 1]] the length of each of those edges
+class RoadGraph:
+    def __init__(
+        self,
+        nodes: np.ndarray,
+        offsets: np.ndarray,
+        targets: np.ndarray,
+        lengths: np.ndarray,
+        pointIds: np.ndarray,
+    ) -> None:
+        # Node coordinates, one (x, y) row per node id
+        self.nodes = nodes
+
+        # CSR adjacency arrays
+        self.offsets = offsets
+        self.targets = targets
+        self.lengths = lengths
+
+        # Node id of each entry in the road points list the graph was built
+        # from. Points can be repeated (e.g. where two roads meet), so this
+        # keeps the same distribution when picking a random point
+        self.pointIds = pointIds
+
+        # Plain Python copies of the arrays above, which are much faster to
+        # index one element at a time (as in A*)
+        self.nodeVectors: list[Vector2] = [Vector2(x, y) for x, y in nodes.tolist()]
+        self.offsetsList: list[int] = offsets.tolist()
+        self.targetsList: list[int] = targets.tolist()
+        self.lengthsList: list[float] = lengths.tolist()
+        self.pointIdsList: list[int] = pointIds.tolist()
+
+        # Node id for each node coordinate key (see utils.vecToStr). Only
+        # meant for converting positions to ids, not for hot paths
+        self.idByKey: dict[str, int] = {
+            utils.vecToStr(v): i for i, v in enumerate(self.nodeVectors)
+        }
+
+        # Grid index of the nodes, for closest node queries
+        self.nodeIndex = NodeIndex(nodes)
+
+    # Compiles a graph from road points and a string-keyed nodes graph, as
+    # generated by the road rules
+    @staticmethod
+    def fromNodesGraph(points: list[Vector2], nodesGraph: dict[str, list[Vector2]]) -> RoadGraph:
+        idByKey: dict[str, int] = {}
+        nodeVectors: list[Vector2] = []
+
+        # Returns id for a node position, creating one if needed
+        def getId(key: str, pos: Vector2) -> int:
+            nodeId = idByKey.get(key)
+            if nodeId is None:
+                nodeId = len(nodeVectors)
+                idByKey[key] = nodeId
+                nodeVectors.append(pos)
+            return nodeId
+
+        # Give ids to points first, in order
+        pointIds = [getId(utils.vecToStr(p), p) for p in points]
+
+        # Nodes which are only present on the graph
+        for key, connections in nodesGraph.items():
+            x, y = key.split("|")
+            getId(key, Vector2(int(x), int(y)))
+            for p in connections:
+                getId(utils.vecToStr(p), p)
+
+        # Build CSR arrays, keeping the connections order
+        numNodes = len(nodeVectors)
+        connectionsById: list[list[Vector2]] = [[] for _ in range(numNodes)]
+        for key, connections in nodesGraph.items():
+            connectionsById[idByKey[key]] = connections
+
+        offsets = [0]
+        targets: list[int] = []
+        lengths: list[float] = []
+        for nodeId, connections in enumerate(connectionsById):
+            start = nodeVectors[nodeId]
+            for p in connections:
+                targets.append(idByKey[utils.vecToStr(p)])
+                lengths.append(start.distance_to(p))
+            offsets.append(len(targets))
+
+        return RoadGraph(
+            np.array([(v.x, v.y) for v in nodeVectors], dtype=np.float64).reshape(-1, 2),
+            np.array(offsets, dtype=np.int32),
+            np.array(targets, dtype=np.int32),
+            np.array(lengths, dtype=np.float64),
+            np.array(pointIds, dtype=np.int32),
+        )
+
+    # Number of nodes in the graph
+    def numNodes(self) -> int:
+        return len(self.nodeVectors)
+
+    # Returns id of the node at a given position, or None if there's no node there
+    def nodeId(self, pos: Vector2) -> int | None:
+        return self.idByKey.get(utils.vecToStr(pos))
+
+    # Returns ids of the nodes a given node connects to
+    def neighbors(self, nodeId: int) -> list[int]:
+        return self.targetsList[self.offsetsList[nodeId]:self.offsetsList[nodeId + 1]]
+
+    # Returns id of the node closest to a given position
+    def closestNode(self, pos: Vector2) -> int:
+        return self.nodeIndex.closest(pos.x, pos.y)
+
+    # Returns ids of the nodes closest to each of the given positions
+    def closestNodes(self, positions: list[Vector2]) -> list[int]:
+        return self.nodeIndex.closestMany([(pos.x, pos.y) for pos in positions])
@@ -0,0 +1,180 @@
+import math
+import pygame
+import utils
+from collections import OrderedDict
+from pygame.math import Vector2
+from model.road import Road, StraightRoad
+from model.road_graph import RoadGraph
+
+# Size of the square world chunks roads are pre-rendered in
+ROAD_CHUNK_SIZE = 512
+
+# Max number of pre-rendered chunks kept at once
+MAX_CACHED_CHUNKS = 256
+
+# Extra space around each road, measured in road widths. Roads like
+# roundabouts are drawn well beyond their center point
+ROAD_LAYER_PADDING = 2
+
+# Extra space around debug points, for the circle drawn on them
+DEBUG_POINT_PADDING = 8
+
+# Background color of the road layer
+ROAD_LAYER_BACKGROUND = (0, 0, 0)
+
+# Road network pre-rendered into world-space chunk surfaces.
+#
+# Roads never change during a simulation, so each chunk is drawn once (when
+# it first becomes visible) and just blitted at the camera offset after that.
+# Roads, and the debug points and graph arrows, are indexed by the chunks they
+# overlap, so drawing a chunk only touches what's inside it. Chunks are only
+# drawn again when the debug flag they were drawn with changes
+class RoadLayer:
+    def __init__(
+        self,
+        roads: list[Road],
+        points: list[Vector2],
+        roadGraph: RoadGraph,
+        chunkSize: int = ROAD_CHUNK_SIZE,
+        maxChunks: int = MAX_CACHED_CHUNKS,
+    ) -> None:
+        self.roads = roads
+        self.points = points
+        self.roadGraph = roadGraph
+        self.chunkSize = chunkSize
+        self.maxChunks = maxChunks
+
+        # Indices of roads, points and graph edges (start, end node ids)
+        # overlapping each chunk, keyed by chunk coordinates
+        self.chunkRoads: dict[tuple[int, int], list[int]] = {}
+        self.chunkPoints: dict[tuple[int, int], list[int]] = {}
+        self.chunkEdges: dict[tuple[int, int], list[tuple[int, int]]] = {}
+        self.buildChunkIndex()
+
+        # Pre-rendered chunk surfaces, from least to most recently used
+        self.chunks: OrderedDict[tuple[int, int], pygame.Surface] = OrderedDict()
+
+        # Debug flag the chunks were drawn with
+        self.debug = False
+
+    # Adds an item to all chunks overlapped by a world area
+    def indexArea(
+        self,
+        index: dict[tuple[int, int], list],
+        item,
+        minX: float,
+        minY: float,
+        maxX: float,
+        maxY: float,
+    ) -> None:
+        for cy in range(math.floor(minY / self.chunkSize), math.floor(maxY / self.chunkSize) + 1):
+            for cx in range(math.floor(minX / self.chunkSize), math.floor(maxX / self.chunkSize) + 1):
+                index.setdefault((cx, cy), []).append(item)
+
+    # Indexes roads, points and graph edges by chunk
+    def buildChunkIndex(self) -> None:
+        for i, road in enumerate(self.roads):
+            padding = road.width * ROAD_LAYER_PADDING
+            if isinstance(road, StraightRoad):
+                minX, maxX = sorted((road.start.x, road.end.x))
+                minY, maxY = sorted((road.start.y, road.end.y))
+            else:
+                minX = maxX = road.center.x
+                minY = maxY = road.center.y
+            self.indexArea(self.chunkRoads, i, minX - padding, minY - padding, maxX + padding, maxY + padding)
+
+        for i, point in enumerate(self.points):
+            self.indexArea(
+                self.chunkPoints,
+                i,
+                point.x - DEBUG_POINT_PADDING,
+                point.y - DEBUG_POINT_PADDING,
+                point.x + DEBUG_POINT_PADDING,
+                point.y + DEBUG_POINT_PADDING,
+            )
+
+        nodes = self.roadGraph.nodeVectors
+        for node, start in enumerate(nodes):
+            for neighbor in self.roadGraph.neighbors(node):
+                end = nodes[neighbor]
+
+                # Arrow head lines are a fifth of the arrow length
+                padding = start.distance_to(end) * 0.2 + DEBUG_POINT_PADDING
+                self.indexArea(
+                    self.chunkEdges,
+                    (node, neighbor),
+                    min(start.x, end.x) - padding,
+                    min(start.y, end.y) - padding,
+                    max(start.x, end.x) + padding,
+                    max(start.y, end.y) + padding,
+                )
+
+    # Removes all pre-rendered chunks, so they're drawn again on next use
+    def invalidate(self) -> None:
+        self.chunks.clear()
+
+    # Returns pre-rendered surface for a chunk, or None if the chunk is empty
+    def getChunk(self, chunk: tuple[int, int], debug: bool) -> pygame.Surface | None:
+        if debug != self.debug:
+            self.invalidate()
+            self.debug = debug
+
+        surface = self.chunks.get(chunk)
+        if surface is not None:
+            self.chunks.move_to_end(chunk)
+            return surface
+
+        if chunk not in self.chunkRoads and not (debug and (chunk in self.chunkPoints or chunk in self.chunkEdges)):
+            return None
+
+        surface = self.renderChunk(chunk, debug)
+        if self.maxChunks > 0:
+            self.chunks[chunk] = surface
+            while len(self.chunks) > self.maxChunks:
+                self.chunks.popitem(last=False)
+        return surface
+
+    # Draws all roads (and debug info if needed) overlapping a chunk
+    def renderChunk(self, chunk: tuple[int, int], debug: bool) -> pygame.Surface:
+        surface = pygame.Surface((self.chunkSize, self.chunkSize))
+        if pygame.display.get_surface() is not None:
+            # Same pixel format as the window, for faster blits
+            surface = surface.convert()
+        surface.fill(ROAD_LAYER_BACKGROUND)
+
+        offset = Vector2(-chunk[0] * self.chunkSize, -chunk[1] * self.chunkSize)
+        for i in self.chunkRoads.get(chunk, []):
+            self.roads[i].draw(surface, offset, debug)
+
+        if debug:
+            for i in self.chunkPoints.get(chunk, []):
+                pygame.draw.circle(surface, (0, 127, 255), self.points[i] + offset, 5, 2)
+
+            nodes = self.roadGraph.nodeVectors
+            for start, end in self.chunkEdges.get(chunk, []):
+                utils.drawArrow(surface, nodes[start] + offset, nodes[end] + offset, (255, 0, 127), 2)
+
+        return surface
+
+    # Draws the visible part of the road layer on a surface, at a given world
+    # offset. Only chunks overlapping the surface are drawn
+    def draw(self, surface: pygame.Surface, offset: Vector2 = Vector2(0, 0), debug: bool = False) -> None:
+        # NOTE: Rounded once, so all chunks get the same pixel offset and
+        # there are no gaps between them
+        offsetX = math.floor(offset.x)
+        offsetY = math.floor(offset.y)
+
+        # Visible world area
+        minX = -offsetX
+        minY = -offsetY
+        maxX = minX + surface.get_width()
+        maxY = minY + surface.get_height()
+
+        for cy in range(math.floor(minY / self.chunkSize), math.floor(maxY / self.chunkSize) + 1):
+            for cx in range(math.floor(minX / self.chunkSize), math.floor(maxX / self.chunkSize) + 1):
+                chunkSurface = self.getChunk((cx, cy), debug)
+                if chunkSurface is not None:
+                    surface.blit(
+                        chunkSurface,
+                        (cx * self.chunkSize + offsetX, cy * self.chunkSize + offsetY),
+                    )
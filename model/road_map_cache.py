@@ -0,0 +1,262 @@
+import hashlib
+import os
+import zipfile
+import numpy as np
+from pygame.math import Vector2
+import utils
+from model.road_graph import RoadGraph
+from model.road import (
+    Road,
+    StraightRoad,
+    CurvedRoad,
+    Roundabout,
+    IntersectionT,
+    Intersection4,
+    ROAD_RULES_VERSION,
+    readRoadLines,
+    rasterizeRoadLines,
+    applyRoadRules,
+)
+
+# Version of the compiled road map file layout. Needs to be increased every
+# time the stored arrays change
+COMPILED_MAP_FORMAT_VERSION = 1
+
+# Extension for compiled road map files, saved next to their source map
+COMPILED_MAP_EXTENSION = ".compiled.npz"
+
+# Road type codes stored in compiled road maps
+ROAD_TYPE_STRAIGHT = 0
+ROAD_TYPE_CURVED = 1
+ROAD_TYPE_ROUNDABOUT = 2
+ROAD_TYPE_INTERSECTION_T = 3
+ROAD_TYPE_INTERSECTION_4 = 4
+
+# Number of parameters stored for each road, unused ones are left as 0
+ROAD_NUM_PARAMS = 7
+
+# Road map with everything the road rules generate from its road lines
+class CompiledRoadMap:
+    def __init__(
+        self,
+        roads: list[Road],
+        points: list[Vector2],
+        nodesGraph: dict[str, list[Vector2]],
+        tiles: np.ndarray,
+        roadGraph: RoadGraph,
+    ) -> None:
+        # Roads for rendering
+        self.roads = roads
+
+        # Road points for generating paths
+        self.points = points
+
+        # Nodes graph generated by the road rules, keyed by node position
+        self.nodesGraph = nodesGraph
+
+        # Tile map with the values set by the road rules
+        self.tiles = tiles
+
+        # Nodes graph compiled for creating paths with A*
+        self.roadGraph = roadGraph
+
+# Returns the compiled file path for a road map file
+def compiledMapPath(filePath: str) -> str:
+    return os.path.splitext(filePath)[0] + COMPILED_MAP_EXTENSION
+
+# Returns hash of a road map file contents
+def roadMapHash(filePath: str) -> str:
+    with open(filePath, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+# Runs the whole road rules pipeline on a road map file
+def compileRoadMap(filePath: str, roadWidth: float, curveArcOffset: float) -> CompiledRoadMap:
+    roadLines = readRoadLines(filePath)
+
+    # Create tile map with all road tiles set
+    tiles = rasterizeRoadLines(roadLines)
+
+    # Check rules to identify curves and calculate node points
+    nodesGraph: dict[str, list[Vector2]] = {}
+    roads, points, tileMap = applyRoadRules(tiles, nodesGraph, roadWidth, curveArcOffset)
+
+    return CompiledRoadMap(
+        roads,
+        points,
+        nodesGraph,
+        np.array(tileMap, dtype=np.uint8).reshape(tiles.shape),
+        RoadGraph.fromNodesGraph(points, nodesGraph),
+    )
+
+# Returns compiled road map for a road map file. With [useCache], the result is
+# read from the compiled file next to the map when it was made from the same
+# map contents, rules and road sizes, and saved there otherwise
+def loadCompiledRoadMap(
+    filePath: str,
+    roadWidth: float,
+    curveArcOffset: float,
+    useCache: bool = True,
+) -> CompiledRoadMap:
+    if not useCache:
+        return compileRoadMap(filePath, roadWidth, curveArcOffset)
+
+    sourceHash = roadMapHash(filePath)
+    cachePath = compiledMapPath(filePath)
+    compiled = readCompiledRoadMap(cachePath, sourceHash, roadWidth, curveArcOffset)
+    if compiled is None:
+        compiled = compileRoadMap(filePath, roadWidth, curveArcOffset)
+        writeCompiledRoadMap(cachePath, compiled, sourceHash, roadWidth, curveArcOffset)
+
+    return compiled
+
+# Returns type code and parameters of a road
+def encodeRoad(road: Road) -> tuple[int, list[float]]:
+    if type(road) is StraightRoad:
+        return ROAD_TYPE_STRAIGHT, [road.width, road.start.x, road.start.y, road.end.x, road.end.y]
+    if type(road) is CurvedRoad:
+        return ROAD_TYPE_CURVED, [road.width, road.center.x, road.center.y, road.arcOffset, road.curveAngle]
+    if type(road) is Roundabout:
+        return ROAD_TYPE_ROUNDABOUT, [
+            road.width, road.center.x, road.center.y,
+            road.connectTop, road.connectBottom, road.connectLeft, road.connectRight,
+        ]
+    if type(road) is IntersectionT:
+        return ROAD_TYPE_INTERSECTION_T, [road.width, road.center.x, road.center.y, road.arcOffset, road.curveAngle]
+    if type(road) is Intersection4:
+        return ROAD_TYPE_INTERSECTION_4, [road.width, road.center.x, road.center.y, road.arcOffset]
+
+    raise ValueError(f"Can't encode road of type {type(road).__name__}")
+
+# Creates a road from its type code and parameters (see encodeRoad)
+def decodeRoad(roadType: int, params: list[float]) -> Road:
+    width = params[0]
+    center = Vector2(params[1], params[2])
+    if roadType == ROAD_TYPE_STRAIGHT:
+        return StraightRoad(width, center, Vector2(params[3], params[4]))
+    if roadType == ROAD_TYPE_CURVED:
+        return CurvedRoad(width, center, params[3], params[4])
+    if roadType == ROAD_TYPE_ROUNDABOUT:
+        return Roundabout(
+            width,
+            center,
+            connectTop=bool(params[3]),
+            connectBottom=bool(params[4]),
+            connectLeft=bool(params[5]),
+            connectRight=bool(params[6]),
+        )
+    if roadType == ROAD_TYPE_INTERSECTION_T:
+        return IntersectionT(width, center, params[3], params[4])
+    if roadType == ROAD_TYPE_INTERSECTION_4:
+        return Intersection4(width, center, params[3])
+
+    raise ValueError(f"Unknown road type {roadType}")
+
+# Saves a compiled road map. The cache is optional, so a map that can't be
+# saved (e.g. on a read-only folder) is just compiled again next time
+def writeCompiledRoadMap(
+    cachePath: str,
+    compiled: CompiledRoadMap,
+    sourceHash: str,
+    roadWidth: float,
+    curveArcOffset: float,
+) -> None:
+    roadTypes = np.zeros(len(compiled.roads), dtype=np.int8)
+    roadParams = np.zeros((len(compiled.roads), ROAD_NUM_PARAMS), dtype=np.float64)
+    for i, road in enumerate(compiled.roads):
+        roadType, params = encodeRoad(road)
+        roadTypes[i] = roadType
+        roadParams[i, :len(params)] = params
+
+    # Node ids of the nodes graph keys, in the graph's order
+    graph = compiled.roadGraph
+    graphKeys = np.array([graph.idByKey[key] for key in compiled.nodesGraph], dtype=np.int32)
+
+    # Write to a temporary file first, so a partially written file is never
+    # picked up as a compiled map
+    # NOTE: Unique per process, so processes compiling the same map at once
+    # don't write to the same file
+    tmpPath = f"{cachePath}.{os.getpid()}.tmp"
+    try:
+        with open(tmpPath, "wb") as f:
+            np.savez_compressed(
+                f,
+                formatVersion=COMPILED_MAP_FORMAT_VERSION,
+                rulesVersion=ROAD_RULES_VERSION,
+                sourceHash=sourceHash,
+                roadWidth=roadWidth,
+                curveArcOffset=curveArcOffset,
+                roadTypes=roadTypes,
+                roadParams=roadParams,
+                points=np.array([(p.x, p.y) for p in compiled.points], dtype=np.float64).reshape(-1, 2),
+                graphKeys=graphKeys,
+                nodes=graph.nodes,
+                offsets=graph.offsets,
+                targets=graph.targets,
+                lengths=graph.lengths,
+                pointIds=graph.pointIds,
+                tiles=compiled.tiles,
+            )
+        os.replace(tmpPath, cachePath)
+    except OSError as e:
+        # Don't leave the partially written file behind
+        try:
+            os.unlink(tmpPath)
+        except FileNotFoundError:
+            pass
+        print(f"[WARNING]: Couldn't save compiled road map to \"{cachePath}\": {e}")
+
+# Reads a compiled road map, returning None if there's no compiled file or if
+# it wasn't made from the same map contents, rules and road sizes
+def readCompiledRoadMap(
+    cachePath: str,
+    sourceHash: str,
+    roadWidth: float,
+    curveArcOffset: float,
+) -> CompiledRoadMap | None:
+    if not os.path.exists(cachePath):
+        return None
+
+    try:
+        with np.load(cachePath, allow_pickle=False) as data:
+            if (
+                int(data["formatVersion"]) != COMPILED_MAP_FORMAT_VERSION or
+                int(data["rulesVersion"]) != ROAD_RULES_VERSION or
+                str(data["sourceHash"]) != sourceHash or
+                float(data["roadWidth"]) != roadWidth or
+                float(data["curveArcOffset"]) != curveArcOffset
+            ):
+                return None
+
+            roadTypes = data["roadTypes"].tolist()
+            roadParams = data["roadParams"].tolist()
+            points = data["points"].tolist()
+            graphKeys = data["graphKeys"].tolist()
+            roadGraph = RoadGraph(
+                data["nodes"],
+                data["offsets"],
+                data["targets"],
+                data["lengths"],
+                data["pointIds"],
+            )
+            tiles = data["tiles"]
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        # Broken compiled file, compile the map again
+        return None
+
+    roads = [decodeRoad(roadType, params) for roadType, params in zip(roadTypes, roadParams)]
+
+    # Rebuild nodes graph from the compiled graph, keeping its order
+    nodes = roadGraph.nodeVectors
+    nodesGraph: dict[str, list[Vector2]] = {}
+    for nodeId in graphKeys:
+        nodesGraph[utils.vecToStr(nodes[nodeId])] = [
+            Vector2(nodes[neighbor]) for neighbor in roadGraph.neighbors(nodeId)
+        ]
+
+    return CompiledRoadMap(
+        roads,
+        [Vector2(x, y) for x, y in points],
+        nodesGraph,
+        tiles,
+        roadGraph,
+    )
@@ -0,0 +1,186 @@
+import heapq
+from collections import OrderedDict
+from pygame.math import Vector2
+import utils
+from model.road_graph import RoadGraph
+from model.profiler import SimProfiler
+
+# Default max number of paths kept in a route cache
+DEFAULT_MAX_PATHS = 2048
+
+# Default max number of shortest-path trees kept in a route cache
+DEFAULT_MAX_TREES = 256
+
+# Finds smoothed paths between road graph nodes, remembering the most recently
+# used ones so repeated (start, goal) pairs don't need a new search.
+#
+# By default paths are found with A*. With [useTrees], a shortest-path tree
+# towards each requested goal is computed once (with a reverse Dijkstra), and
+# any path to that goal is then found by just following the tree
+class RouteCache:
+    def __init__(
+        self,
+        roadGraph: RoadGraph,
+        maxPaths: int = DEFAULT_MAX_PATHS,
+        useTrees: bool = False,
+        maxTrees: int = DEFAULT_MAX_TREES,
+    ) -> None:
+        assert maxPaths >= 0 and maxTrees >= 0, "Cache sizes can't be negative"
+
+        # Graph the paths are found on
+        self.roadGraph = roadGraph
+
+        # Smoothed paths (or None if there's no path), keyed by (start, goal)
+        # node ids, from least to most recently used
+        self.paths: OrderedDict[tuple[int, int], list[Vector2] | None] = OrderedDict()
+        self.maxPaths = maxPaths
+
+        # Whether paths are found using shortest-path trees instead of A*
+        self.useTrees = useTrees
+
+        # Next node towards the goal for every node (-1 if the goal can't be
+        # reached), keyed by goal node id, from least to most recently used
+        self.trees: OrderedDict[int, list[int]] = OrderedDict()
+        self.maxTrees = maxTrees
+
+        # Incoming edges of each node, in CSR form (see RoadGraph). Only
+        # built when trees are used
+        self.reverseOffsets: list[int] = []
+        self.reverseSources: list[int] = []
+        self.reverseLengths: list[float] = []
+        if useTrees:
+            self.buildReverseGraph()
+
+        # Cache statistics
+        self.hits = 0
+        self.misses = 0
+
+        # Profiler counting cache hits, misses and search expansions, if any
+        self.profiler: SimProfiler | None = None
+
+    # Returns smoothed path from [start] to [goal] node ids, or None if
+    # there's no path
+    def findPath(self, start: int, goal: int) -> list[Vector2] | None:
+        key = (start, goal)
+        if key in self.paths:
+            self.hits += 1
+            if self.profiler is not None:
+                self.profiler.count("routeCacheHits")
+            self.paths.move_to_end(key)
+            return self.paths[key]
+
+        self.misses += 1
+        if self.profiler is not None:
+            self.profiler.count("routeCacheMisses")
+        if self.useTrees:
+            path = self.followTree(start, goal)
+        else:
+            path = utils.A_Star(self.roadGraph, start, goal, self.profiler)
+        if path is not None:
+            path = utils.smoothPathCurves(path)
+
+        # Save path, evicting least recently used ones if needed
+        if self.maxPaths > 0:
+            self.paths[key] = path
+            while len(self.paths) > self.maxPaths:
+                self.paths.popitem(last=False)
+
+        return path
+
+    # Computes trees for the given goal node ids (all road points by default)
+    # ahead of time, as long as they fit in the cache
+    def precomputeTrees(self, goals: list[int] | None = None) -> None:
+        if not self.useTrees:
+            return
+
+        if goals is None:
+            goals = list(dict.fromkeys(self.roadGraph.pointIdsList))
+        for goal in goals[:self.maxTrees]:
+            self.getTree(goal)
+
+    # Removes all cached paths and trees
+    def clear(self) -> None:
+        self.paths.clear()
+        self.trees.clear()
+
+    # Builds incoming edges arrays from the graph's outgoing edges
+    def buildReverseGraph(self) -> None:
+        graph = self.roadGraph
+        numNodes = graph.numNodes()
+        offsets = graph.offsetsList
+        targets = graph.targetsList
+        lengths = graph.lengthsList
+
+        incoming: list[list[tuple[int, float]]] = [[] for _ in range(numNodes)]
+        for source in range(numNodes):
+            for edge in range(offsets[source], offsets[source + 1]):
+                incoming[targets[edge]].append((source, lengths[edge]))
+
+        self.reverseOffsets = [0]
+        self.reverseSources = []
+        self.reverseLengths = []
+        for edges in incoming:
+            for source, length in edges:
+                self.reverseSources.append(source)
+                self.reverseLengths.append(length)
+            self.reverseOffsets.append(len(self.reverseSources))
+
+    # Returns shortest-path tree towards a goal node, computing it if needed
+    def getTree(self, goal: int) -> list[int]:
+        tree = self.trees.get(goal)
+        if tree is not None:
+            self.trees.move_to_end(goal)
+            return tree
+
+        tree = self.reverseDijkstra(goal)
+        if self.maxTrees > 0:
+            self.trees[goal] = tree
+            while len(self.trees) > self.maxTrees:
+                self.trees.popitem(last=False)
+        return tree
+
+    # Runs Dijkstra from [goal] following edges backwards, so the result
+    # holds, for every node, the next node on its shortest path to [goal]
+    def reverseDijkstra(self, goal: int) -> list[int]:
+        numNodes = self.roadGraph.numNodes()
+        offsets = self.reverseOffsets
+        sources = self.reverseSources
+        lengths = self.reverseLengths
+
+        dist: list[float] = [1e10] * numNodes
+        nextNode: list[int] = [-1] * numNodes
+        dist[goal] = 0
+        openSet: list[tuple[float, int]] = [(0, goal)]
+        expanded = 0
+        while len(openSet) > 0:
+            d, current = heapq.heappop(openSet)
+            if d > dist[current]:
+                # Outdated entry
+                continue
+            expanded += 1
+
+            for edge in range(offsets[current], offsets[current + 1]):
+                source = sources[edge]
+                newDist = d + lengths[edge]
+                if newDist < dist[source]:
+                    dist[source] = newDist
+                    nextNode[source] = current
+                    heapq.heappush(openSet, (newDist, source))
+
+        if self.profiler is not None:
+            self.profiler.count("dijkstraExpansions", expanded)
+        return nextNode
+
+    # Returns unsmoothed path from [start] to [goal] following the goal's tree
+    def followTree(self, start: int, goal: int) -> list[Vector2] | None:
+        tree = self.getTree(goal)
+        if start != goal and tree[start] == -1:
+            return None
+
+        nodes = self.roadGraph.nodeVectors
+        path = [nodes[start]]
+        current = start
+        while current != goal:
+            current = tree[current]
+            path.append(nodes[current])
+        return path
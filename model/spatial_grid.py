@@ -0,0 +1,71 @@
+import math
+from typing import Any
+from pygame.math import Vector2
+
+# Uniform grid that buckets items by position, for fast neighbour queries
+class SpatialGrid:
+    def __init__(self, cellSize: float) -> None:
+        assert cellSize > 0, "Cell size must be positive"
+
+        # Size of each (square) grid cell
+        self.cellSize = cellSize
+
+        # Items per cell, keyed by cell index (i, j). Each entry also stores
+        # the insertion order, so query results keep a stable order
+        self.cells: dict[tuple[int, int], list[tuple[int, Any]]] = {}
+
+        # Biggest radius of all inserted items, used to expand queries so
+        # items whose center is in a neighbour cell are not missed
+        self.maxRadius = 0.0
+
+        # Number of items inserted since last clear
+        self.count = 0
+
+    # Removes all items from the grid
+    def clear(self) -> None:
+        self.cells.clear()
+        self.maxRadius = 0.0
+        self.count = 0
+
+    # Returns the cell index for a given position
+    def cellIndex(self, x: float, y: float) -> tuple[int, int]:
+        return math.floor(x / self.cellSize), math.floor(y / self.cellSize)
+
+    # Inserts an item at a given position, with a given bounding radius
+    def insert(self, item: Any, pos: Vector2, radius: float = 0) -> None:
+        key = self.cellIndex(pos.x, pos.y)
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = []
+            self.cells[key] = cell
+        cell.append((self.count, item))
+        self.count += 1
+
+        if radius > self.maxRadius:
+            self.maxRadius = radius
+
+    # Returns all items that may overlap the given axis-aligned box, in
+    # insertion order
+    def query(self, minX: float, minY: float, maxX: float, maxY: float) -> list[Any]:
+        # Expand box so items near the border are still found
+        r = self.maxRadius
+        i0, j0 = self.cellIndex(minX - r, minY - r)
+        i1, j1 = self.cellIndex(maxX + r, maxY + r)
+
+        found: list[tuple[int, Any]] = []
+        cells = self.cells
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(cells):
+            # Box covers more cells than there are occupied ones, so it's
+            # cheaper to check every occupied cell
+            for (i, j), cell in cells.items():
+                if i0 <= i <= i1 and j0 <= j <= j1:
+                    found.extend(cell)
+        else:
+            for j in range(j0, j1 + 1):
+                for i in range(i0, i1 + 1):
+                    cell = cells.get((i, j))
+                    if cell is not None:
+                        found.extend(cell)
+
+        found.sort(key=lambda entry: entry[0])
+        return [item for _, item in found]
@@ -0,0 +1,97 @@
+import pygame
+from collections import OrderedDict
+from pygame.math import Vector2
+
+# Size (in degrees) of the rotation buckets sprites are rotated to
+ROTATION_STEP = 1
+
+# Default max number of rotated sprites kept in an atlas
+DEFAULT_MAX_ROTATIONS = 2048
+
+# Key for a texture in a sprite atlas: (path, width, offset angle)
+TextureKey = tuple[str, float, float]
+
+# Textures shared by everything drawn with them, along with their rotations.
+#
+# Each texture is loaded from disk and scaled only once. Rotations are
+# quantized to ROTATION_STEP degree buckets, so every sprite only needs to be
+# rotated once per bucket, and the most recently used ones are kept
+class SpriteAtlas:
+    def __init__(self, rotationStep: float = ROTATION_STEP, maxRotations: int = DEFAULT_MAX_ROTATIONS) -> None:
+        assert rotationStep > 0, "Rotation step must be positive"
+        assert maxRotations >= 0, "Cache size can't be negative"
+
+        # Loaded textures (or None if loading failed), keyed by texture key
+        self.textures: dict[TextureKey, pygame.Surface | None] = {}
+
+        # Rotated textures, keyed by (texture key, rotation bucket), from
+        # least to most recently used
+        self.rotations: OrderedDict[tuple[TextureKey, int], pygame.Surface] = OrderedDict()
+        self.rotationStep = rotationStep
+        self.maxRotations = maxRotations
+
+        # Number of rotation buckets in a full turn
+        self.numBuckets = round(360 / rotationStep)
+
+    # Returns key for a texture loaded from [path], rotated by [offsetAngle]
+    # degrees and scaled to [width] pixels wide (keeping its aspect ratio),
+    # or None if it couldn't be loaded
+    def loadTexture(self, path: str, width: float, offsetAngle: float = 0) -> TextureKey | None:
+        key = (path, width, offsetAngle)
+        if key not in self.textures:
+            self.textures[key] = self.createTexture(path, width, offsetAngle)
+
+        if self.textures[key] is None:
+            return None
+        return key
+
+    # Loads, rotates and scales a texture
+    def createTexture(self, path: str, width: float, offsetAngle: float) -> pygame.Surface | None:
+        try:
+            texture = pygame.image.load(path)
+        except FileNotFoundError:
+            print(f"Error loading texture from path \"{path}\"")
+            return None
+
+        # Same pixel format as the window, for faster rotations and blits
+        if pygame.display.get_surface() is not None:
+            texture = texture.convert_alpha()
+
+        # Rotate
+        if offsetAngle != 0:
+            texture = pygame.transform.rotate(texture, offsetAngle)
+
+        # Resize
+        texSize = Vector2(texture.get_size())
+        texAspectRatio = texSize.y / texSize.x
+        return pygame.transform.scale(texture, (width, width * texAspectRatio))
+
+    # Returns a loaded texture
+    def texture(self, key: TextureKey) -> pygame.Surface:
+        return self.textures[key]
+
+    # Returns a loaded texture rotated by [angle] degrees, rounded to the
+    # closest rotation bucket
+    def rotated(self, key: TextureKey, angle: float) -> pygame.Surface:
+        bucket = round(angle / self.rotationStep) % self.numBuckets
+        rotationKey = (key, bucket)
+
+        surface = self.rotations.get(rotationKey)
+        if surface is not None:
+            self.rotations.move_to_end(rotationKey)
+            return surface
+
+        surface = pygame.transform.rotate(self.textures[key], bucket * self.rotationStep)
+        if self.maxRotations > 0:
+            self.rotations[rotationKey] = surface
+            while len(self.rotations) > self.maxRotations:
+                self.rotations.popitem(last=False)
+        return surface
+
+    # Removes all loaded textures and rotations
+    def clear(self) -> None:
+        self.textures.clear()
+        self.rotations.clear()
+
+# Atlas shared by all cars by default
+sharedSpriteAtlas = SpriteAtlas()
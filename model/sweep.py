@@ -0,0 +1,153 @@
+# Runs many headless simulations over a grid of parameters (maps, car counts,
+# desired velocity ranges, seeds...), spread over a pool of processes. Run
+# from the repo root with:
+#
+#   python3 -m model.sweep --maps road_maps/a.json --cars 50 100 --seeds 0 1 2
+#
+# Each run's metrics are written as one JSON line as soon as it finishes, so
+# results can be followed (and kept) while the sweep is still running
+import argparse
+import itertools
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TextIO
+
+# NOTE: Workers import pygame too, this hides its welcome message on each one
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from model.headless import HeadlessSimulation, DEFAULT_DT
+from model.road_map_cache import loadCompiledRoadMap
+from model.traffic_sim import ROAD_WIDTH, CURVE_ARC_OFFSET, DESIRED_VELOCITY_RANGE
+
+# Default number of ticks simulated by each run (one simulated minute)
+DEFAULT_TICKS = 3600
+
+# Returns one configuration per combination of the values in [grid], keyed
+# by parameter name. Combinations are in order, with the last parameter
+# changing fastest, e.g.:
+#
+#   sweepConfigs({"cars": [10, 20], "seed": [0, 1]})
+#   -> [{"cars": 10, "seed": 0}, {"cars": 10, "seed": 1}, {"cars": 20, "seed": 0}, ...]
+def sweepConfigs(grid: dict[str, list]) -> list[dict]:
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+# Runs one headless simulation for a configuration, returning its stats.
+# Configurations have a "map" and number of "cars", and optionally "seed",
+# "ticks", "dt", "desiredVelocity" (a [min, max] range), "roadWidth",
+# "curveArcOffset" and "profile"
+# NOTE: Runs on worker processes, so it needs to be a module level function
+def runScenario(config: dict) -> dict:
+    sim = HeadlessSimulation(
+        config["map"],
+        config["cars"],
+        roadWidth=config.get("roadWidth", ROAD_WIDTH),
+        curveArcOffset=config.get("curveArcOffset", CURVE_ARC_OFFSET),
+        seed=config.get("seed"),
+        profile=config.get("profile", False),
+        desiredVelocityRange=tuple(config.get("desiredVelocity", DESIRED_VELOCITY_RANGE)),
+    )
+    return sim.run(config.get("ticks", DEFAULT_TICKS), config.get("dt", DEFAULT_DT))
+
+# Runs a scenario for the sweep, returning its result line. Errors are
+# reported in the result, so a bad configuration doesn't stop the sweep
+def runSweepScenario(run: int, config: dict) -> dict:
+    try:
+        return {"run": run, "config": config, "stats": runScenario(config)}
+    except Exception:
+        return {"run": run, "config": config, "error": traceback.format_exc()}
+
+# Runs all configurations on [workers] processes (all cores by default),
+# writing each result to [out] as a JSON line in the order runs finish.
+# Returns the number of failed runs
+def runSweep(configs: list[dict], out: TextIO, workers: int | None = None) -> int:
+    assert workers is None or workers > 0, "Number of workers must be positive"
+
+    # Compile each map once before starting, so workers read it from the
+    # compiled map cache instead of all compiling it at the same time
+    compiledMaps: set[tuple[str, float, float]] = set()
+    for config in configs:
+        roadWidth = config.get("roadWidth", ROAD_WIDTH)
+        curveArcOffset = config.get("curveArcOffset", CURVE_ARC_OFFSET)
+        key = (config["map"], roadWidth, curveArcOffset)
+        if key not in compiledMaps:
+            compiledMaps.add(key)
+            try:
+                loadCompiledRoadMap(*key)
+            except Exception:
+                # Runs on this map fail too, and report the error
+                pass
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(runSweepScenario, run, config) for run, config in enumerate(configs)]
+        for future in as_completed(futures):
+            result = future.result()
+            if "error" in result:
+                failed += 1
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    return failed
+
+# Parses a desired velocity range, given as "min:max"
+def velocityRange(value: str) -> tuple[int, int]:
+    try:
+        low, high = (int(v) for v in value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid velocity range \"{value}\", expected min:max")
+    if low > high:
+        raise argparse.ArgumentTypeError(f"Invalid velocity range \"{value}\", min is bigger than max")
+    return low, high
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Runs headless simulations for every combination of parameters")
+    parser.add_argument("--maps", nargs="+", required=True, help="road map files")
+    parser.add_argument("--cars", nargs="+", type=int, required=True, help="numbers of cars")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0], help="random seeds")
+    parser.add_argument(
+        "--velocities",
+        nargs="+",
+        type=velocityRange,
+        default=[DESIRED_VELOCITY_RANGE],
+        help="desired velocity ranges, as min:max",
+    )
+    parser.add_argument("--ticks", type=int, default=DEFAULT_TICKS, help="ticks simulated by each run")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (all cores by default)")
+    parser.add_argument("--profile", action="store_true", help="include profiling statistics of each run")
+    parser.add_argument("--output", default="-", help="JSON lines file results are saved to (- for stdout)")
+    args = parser.parse_args(argv)
+
+    if args.ticks <= 0:
+        parser.error("Number of ticks must be positive")
+    if args.workers is not None and args.workers <= 0:
+        parser.error("Number of workers must be positive")
+    if any(cars <= 0 for cars in args.cars):
+        parser.error("Number of cars must be positive")
+
+    configs = sweepConfigs({
+        "map": args.maps,
+        "cars": args.cars,
+        "desiredVelocity": [list(v) for v in args.velocities],
+        "seed": args.seeds,
+    })
+    for config in configs:
+        config["ticks"] = args.ticks
+        if args.profile:
+            config["profile"] = True
+
+    print(f"Running {len(configs)} simulations", file=sys.stderr)
+    if args.output == "-":
+        failed = runSweep(configs, sys.stdout, args.workers)
+    else:
+        with open(args.output, "w") as f:
+            failed = runSweep(configs, f, args.workers)
+
+    print(f"Finished {len(configs) - failed} of {len(configs)} simulations", file=sys.stderr)
+    if failed > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,19 +1,99 @@
 import pygame
-import json
 import math
 import utils
-from random import randint
+import random
+import hashlib
+import io
+import os
+import time
+import numpy as np
 from pygame.math import Vector2
 from model.driver import Driver
-from model.car import Car
-from model.road import Road, RoadLine, roadRules
+from model.car import Car, MAX_VELOCITY
+from model.spatial_grid import SpatialGrid
+from model.car_state import CarStateStore, SCALAR_FIELDS
+from model.route_cache import RouteCache, DEFAULT_MAX_PATHS
+from model.road import Road
+from model.road_map_cache import loadCompiledRoadMap
+from model.profiler import SimProfiler
+from model.trajectory import TrajectoryRecorder
+
+# Default road width (tile size)
+ROAD_WIDTH = 110
+
+# Default curve arc offset
+CURVE_ARC_OFFSET = 45
+
+# Default range of driver desired velocities, picked at random for each driver
+DESIRED_VELOCITY_RANGE = (70, 110)
+
+# Cell size for the spatial grid used in driver neighbour queries
+DRIVER_GRID_CELL_SIZE = 300
+
+# Version of the snapshot layout (see TrafficSim.snapshot). Snapshots with a
+# different version can't be restored
+SNAPSHOT_FORMAT_VERSION = 3
+
+# Extra space around the view when picking cars to draw, for car textures
+# being bigger than the car itself
+CAR_DRAW_MARGIN = 100
+
+# Returns a new car for the simulation, at a given position and rotation
+def createCar(pos: Vector2, rotation: float, loadTextures: bool = True) -> Car:
+    return Car(
+        pos,
+        size=22,
+        texturePath="img/car.png",
+        textureScale=3.0,
+        textureOffsetAngle=180,
+        wheelAxisAspectRatio=1.8,
+        initialRotation=rotation,
+        loadTextures=loadTextures,
+    )
 
 # Main class for traffic simulation
 class TrafficSim:
-    def __init__(self, roadWidth: float, curveArcOffset: float, roadMapFilePath: str, numCars: int) -> None:
+    def __init__(
+        self,
+        roadWidth: float,
+        curveArcOffset: float,
+        roadMapFilePath: str,
+        numCars: int,
+        headless: bool = False,
+        batchPhysics: bool = False,
+        routeCacheSize: int = DEFAULT_MAX_PATHS,
+        routeTrees: bool = False,
+        useMapCache: bool = True,
+        seed: int | None = None,
+        profiler: SimProfiler | None = None,
+        desiredVelocityRange: tuple[int, int] = DESIRED_VELOCITY_RANGE,
+    ) -> None:
+        assert desiredVelocityRange[0] <= desiredVelocityRange[1], "Invalid desired velocity range"
+
         # List of drivers currently in simulation
         self.drivers: list[Driver] = []
 
+        # Seed for all random choices in the simulation (car spawn points,
+        # desired velocities and destinations). The same seed on the same map
+        # always gives the same simulation. None picks a random seed, which is
+        # kept so the run can still be reproduced
+        if seed is None:
+            seed = random.randrange(2**32)
+        self.seed = seed
+
+        # Random generator for the simulation, shared with its drivers
+        self.rng = random.Random(seed)
+
+        # Range (min, max) of the desired velocity of spawned drivers
+        self.desiredVelocityRange = desiredVelocityRange
+
+        # Whether the simulation runs without rendering (no textures are loaded)
+        self.headless = headless
+
+        # Store for all car states when car physics are updated in a single
+        # vectorized pass, or None when each car updates itself
+        self.carStateStore: CarStateStore | None = CarStateStore() if batchPhysics else None
+
         # Road width
         self.roadWidth = roadWidth
 
@@ -26,136 +106,345 @@ class TrafficSim:
         # List of road points for generating paths
         self.points: list[Vector2] = []
 
-        # Nodes graph for creating paths with A*
+        # Nodes graph generated by the road rules, keyed by node position
         self.nodesGraph: dict[str, list[Vector2]] = {}
 
+        # Spatial grid with drivers bucketed by car position, rebuilt every update
+        self.driverGrid = SpatialGrid(DRIVER_GRID_CELL_SIZE)
+
+        # Whether compiled road maps are read from (and saved to) disk
+        self.useMapCache = useMapCache
+
+        # Road map file the simulation was loaded from
+        self.roadMapFilePath = roadMapFilePath
+
+        # Also sets the nodes graph compiled for creating paths with A*
         self.loadRoadMap(roadMapFilePath)
 
+        # Cache of paths between graph nodes, shared by all drivers. With
+        # [routeTrees], paths come from per-destination shortest-path trees
+        # instead of A*
+        self.routeCache = RouteCache(self.roadGraph, routeCacheSize, useTrees=routeTrees)
+
+        # Profiler timing each phase of the updates, if any (see setProfiler)
+        self.profiler: SimProfiler | None = None
+        self.setProfiler(profiler)
+
+        # Recorder saving car states after each update, if any
+        self.recorder: TrajectoryRecorder | None = None
+
         # Position cars randomly on the map
-        for _ in range(numCars):
-            # Get random point
-            index = randint(0, len(self.points) - 1)
-            angle: float | None = None
+        self.spawnCars(numCars)
 
-            # Make sure it is far from other cars
-            valid = False
-            attemps = 0
-            while not valid and attemps < 30:
-                valid = True
-                attemps += 1
-                index = randint(0, len(self.points) - 1)
-                for driver in self.drivers:
-                    if (driver.car.pos - self.points[index]).magnitude() < self.roadWidth:
-                        valid = False
-                        break
-
-                # If position not valid, restart
-                if not valid:
-                    continue
-
-                # Point is far enough from all other cars, calculate orientation
-                point = self.points[index]
-                connectsTo = self.nodesGraph.get(utils.vecToStr(point))
-                if connectsTo != None and len(connectsTo) > 0 and connectsTo[0] != point:
-                    # This point is connected to at least one other point, use that orientation
-                    direction = (connectsTo[0] - point).normalize()
-                    angle = utils.angleFromDirection(direction)
-                    if angle < 0:
-                        angle += 2 * math.pi
-
-                    # Angle needs to be axis-aligned (either 0, pi/2, pi or 3pi/2)
-                    if (
-                        abs(angle) > 1e-5 and
-                        abs(angle - math.pi / 2) > 1e-5 and
-                        abs(angle - math.pi) > 1e-5 and
-                        abs(angle - 3 * math.pi / 2) > 1e-5
-                    ):
-                        valid = False
-                else:
-                    valid = False
-
-            # If after many attemps still not valid, can't fit any more cars
-            if not valid:
-                print(f"Can't fit any more cars. Max cars: {len(self.drivers)}")
+        # Bucket drivers right away, so cars can be drawn before any update
+        self.rebuildDriverGrid(0)
+
+    # Returns (point index, car rotation) for every road point a car can be
+    # placed on: points connected to another point in an axis-aligned
+    # direction (either 0, pi/2, pi or 3pi/2)
+    def spawnSlots(self) -> list[tuple[int, float]]:
+        graph = self.roadGraph
+        slots: list[tuple[int, float]] = []
+        for index, point in enumerate(self.points):
+            connectsTo = graph.neighbors(graph.pointIdsList[index])
+            if len(connectsTo) == 0 or graph.nodeVectors[connectsTo[0]] == point:
+                continue
+
+            # This point is connected to at least one other point, use that orientation
+            direction = (graph.nodeVectors[connectsTo[0]] - point).normalize()
+            angle = utils.angleFromDirection(direction)
+            if angle < 0:
+                angle += 2 * math.pi
+
+            # Angle needs to be axis-aligned
+            if (
+                abs(angle) > 1e-5 and
+                abs(angle - math.pi / 2) > 1e-5 and
+                abs(angle - math.pi) > 1e-5 and
+                abs(angle - 3 * math.pi / 2) > 1e-5
+            ):
+                continue
+
+            slots.append((index, angle))
+
+        return slots
+
+    # Places [numCars] cars on random spawn slots, each at least a road width
+    # away from all other cars. Slots are tried in random order, skipping the
+    # ones already taken, so cars are only left out once every slot was tried
+    def spawnCars(self, numCars: int) -> None:
+        if numCars <= 0:
+            return
+
+        slots = self.spawnSlots()
+        self.rng.shuffle(slots)
+
+        # Positions of all cars, bucketed by road width, so only cars in
+        # nearby cells need to be checked
+        occupied = SpatialGrid(self.roadWidth)
+        for driver in self.drivers:
+            occupied.insert(driver.car.pos, driver.car.pos)
+
+        placed = 0
+        for index, angle in slots:
+            if placed == numCars:
                 break
 
+            # Make sure it is far from other cars
+            point = self.points[index]
+            nearby = occupied.query(
+                point.x - self.roadWidth,
+                point.y - self.roadWidth,
+                point.x + self.roadWidth,
+                point.y + self.roadWidth,
+            )
+            if any((pos - point).magnitude() < self.roadWidth for pos in nearby):
+                continue
+
             # Add new valid car
             self.addDriver(Driver(
-                car=Car(
-                    point,
-                    size=22,
-                    texturePath="img/car.png",
-                    textureScale=3.0,
-                    textureOffsetAngle=180,
-                    wheelAxisAspectRatio=1.8,
-                    initialRotation=angle,
-                ),
-                # TODO: This could be given as a config parameter
-                desiredVelocity=randint(70, 110),
+                car=createCar(point, angle, loadTextures=not self.headless),
+                desiredVelocity=self.rng.randint(*self.desiredVelocityRange),
+                rng=self.rng,
             ))
+            occupied.insert(point, point)
+            placed += 1
+
+        # Every slot was tried, can't fit any more cars
+        if placed < numCars:
+            print(f"Can't fit any more cars. Max cars: {len(self.drivers)}")
 
     def loadRoadMap(self, filePath: str) -> None:
-        roadLines: list[RoadLine] = []
-        with open(filePath, "r") as f:
-            lst = json.load(f)
-            for obj in lst:
-                # Multiply all coordinates by 2 to create between-tile spacing
-                roadLines.append(RoadLine(
-                    Vector2(
-                        obj["start"]["x"] * 2,
-                        obj["start"]["y"] * 2,
-                    ),
-                    Vector2(
-                        obj["end"]["x"] * 2,
-                        obj["end"]["y"] * 2,
-                    ),
-                ))
-
-        minX = minY = 1e10
-        maxX = maxY = -1e10
-        for roadLine in roadLines:
-            minX = min(minX, roadLine.start.x, roadLine.end.x)
-            minY = min(minY, roadLine.start.y, roadLine.end.y)
-            maxX = max(maxX, roadLine.start.x, roadLine.end.x)
-            maxY = max(maxY, roadLine.start.y, roadLine.end.y)
-        minX = int(minX)
-        minY = int(minY)
-        maxX = int(maxX)
-        maxY = int(maxY)
-        sizeX = maxX - minX + 1
-        sizeY = maxY - minY  +1
-        size = Vector2(sizeX, sizeY)
-
-        # Create tile map filled with zeros and change to 1 on all road tiles
-        self.tiles = [[0] * sizeX for _ in range(sizeY)]
-        # TODO: Maybe this could be optimized
-        for j in range(sizeY):
-            for i in range(sizeX):
-                p = Vector2(i + minX, j + minY)
-                for line in roadLines:
-                    if line.contains(p):
-                        self.tiles[j][i] = 1
-
-        # Check rules to identify curves and calculate node points
-        for rule, callback in roadRules:
-            lines = rule.split("|")
-            sx = int(lines[0])
-            sy = int(lines[1])
-
-            for y in range(sizeY - sy + 1):
-                for x in range(sizeX - sx + 1):
-                    # Get new possible roads and points
-                    roads, points = callback(Vector2(x, y), self.tiles, self.nodesGraph, size, self.roadWidth, self.curveArcOffset)
-                    self.roads.extend(roads)
-                    self.points.extend(points)
+        roadMap = loadCompiledRoadMap(filePath, self.roadWidth, self.curveArcOffset, useCache=self.useMapCache)
+        self.roads.extend(roadMap.roads)
+        self.points.extend(roadMap.points)
+        self.nodesGraph.update(roadMap.nodesGraph)
+        self.tiles = roadMap.tiles.tolist()
+        self.roadGraph = roadMap.roadGraph
+
+    # Sets profiler for the updates, or None to stop profiling
+    def setProfiler(self, profiler: SimProfiler | None) -> None:
+        self.profiler = profiler
+        self.routeCache.profiler = profiler
 
     def update(self, dt: float) -> None:
-        for driver in self.drivers:
-            driver.update(dt, self.drivers, self.points, self.nodesGraph)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.beginTick()
+            t = time.perf_counter_ns()
+
+        # Rebuild spatial grid. Cars move during the update, so pad each
+        # car's radius by the most it can move in a single update
+        self.rebuildDriverGrid(MAX_VELOCITY * dt)
+        if profiler is not None:
+            profiler.lap("grid", t)
+
+        # Keep car states from before the update, so cars can be drawn in
+        # between updates. Headless simulations never draw
+        if not self.headless:
+            for driver in self.drivers:
+                driver.car.savePreviousState()
+
+        # NOTE: With batch physics, all drivers react to the car positions at
+        # the start of the update, and then all cars move at once
+        batchPhysics = self.carStateStore is not None
+        startNodes = self.replanStartNodes()
+        for driver, startNode in zip(self.drivers, startNodes):
+            driver.update(
+                dt,
+                self.drivers,
+                self.routeCache,
+                self.driverGrid,
+                updateCar=not batchPhysics,
+                profiler=profiler,
+                startNode=startNode,
+            )
 
-    def draw(self, surface: pygame.Surface, offset: Vector2 = Vector2(0, 0), debug: bool = False) -> None:
+        if batchPhysics:
+            if profiler is not None:
+                t = time.perf_counter_ns()
+            self.carStateStore.update(dt)
+            if profiler is not None:
+                profiler.lap("physics", t)
+
+        if self.recorder is not None:
+            if profiler is not None:
+                t = time.perf_counter_ns()
+            self.recorder.record(self, dt)
+            if profiler is not None:
+                profiler.lap("record", t)
+
+        if profiler is not None:
+            profiler.count("drivers", len(self.drivers))
+            profiler.endTick()
+
+    # Returns start node of the new path for each driver that needs one this
+    # update (the node closest to its car), or None for the rest. All closest
+    # node queries are done at once
+    # NOTE: Drivers only move their own car, so each car is still at the same
+    # position when its driver updates
+    def replanStartNodes(self) -> list[int | None]:
+        startNodes: list[int | None] = [None] * len(self.drivers)
+        replanning = [i for i, driver in enumerate(self.drivers) if driver.needsNewPath()]
+        if len(replanning) == 0:
+            return startNodes
+
+        closest = self.roadGraph.closestNodes([self.drivers[i].car.pos for i in replanning])
+        for i, node in zip(replanning, closest):
+            startNodes[i] = node
+        return startNodes
+
+    # Buckets all drivers in the spatial grid by their car's position, with
+    # each car's radius padded by [padding]
+    def rebuildDriverGrid(self, padding: float) -> None:
+        self.driverGrid.clear()
         for driver in self.drivers:
-            driver.draw(surface, offset, debug)
+            self.driverGrid.insert(driver, driver.car.pos, driver.car.boundingRadius() + padding)
+
+    # Draws all drivers. With [viewBounds] (minX, minY, maxX, maxY in world
+    # space), only cars in or near that area are drawn, unless on debug,
+    # where paths can go all over the map. [alpha] is how far into the next
+    # update cars are drawn, between 0 (state before the last update) and 1
+    # (current state)
+    def draw(
+        self,
+        surface: pygame.Surface,
+        offset: Vector2 = Vector2(0, 0),
+        debug: bool = False,
+        viewBounds: tuple[float, float, float, float] | None = None,
+        alpha: float = 1,
+    ) -> None:
+        drivers = self.drivers
+        if viewBounds is not None and not debug:
+            # Every car is still inside the area it was added to the grid
+            # with, so the grid finds all cars that can be visible
+            minX, minY, maxX, maxY = viewBounds
+            drivers = self.driverGrid.query(
+                minX - CAR_DRAW_MARGIN,
+                minY - CAR_DRAW_MARGIN,
+                maxX + CAR_DRAW_MARGIN,
+                maxY + CAR_DRAW_MARGIN,
+            )
+
+        for driver in drivers:
+            driver.draw(surface, offset, debug, alpha)
+
+    # Returns a hash of all car states (position, rotation and velocity).
+    # Two runs with the same seed, map and time steps always give the same hash
+    def stateHash(self) -> str:
+        state = np.array(
+            [(d.car.pos.x, d.car.pos.y, d.car.rotation, d.car.velocity) for d in self.drivers],
+            dtype=np.float64,
+        )
+        return hashlib.sha256(state.tobytes()).hexdigest()
+
+    # Returns all driver, car, path and random generator state as a compressed
+    # .npz blob, which restore() can load back into a simulation on the same
+    # map. Roads, textures and cached paths are not included, since they
+    # don't depend on the simulation state
+    def snapshot(self) -> bytes:
+        drivers = self.drivers
+        cars = [driver.car for driver in drivers]
+
+        # Paths are stored one after the other, with each driver's path
+        # length (or -1 if it has no path)
+        pathLengths = [len(d.path) if d.path is not None else -1 for d in drivers]
+        pathPoints = [(p.x, p.y) for d in drivers if d.path is not None for p in d.path]
+
+        rngVersion, rngState, rngGaussNext = self.rng.getstate()
+
+        arrays = {
+            "formatVersion": np.array(SNAPSHOT_FORMAT_VERSION),
+            "numNodes": np.array(self.roadGraph.numNodes()),
+            # NOTE: Seeds can be any int, so they're saved as text
+            "seed": np.array(str(self.seed)),
+            "rngVersion": np.array(rngVersion),
+            "rngState": np.array(rngState, dtype=np.uint32),
+            "rngGaussNext": np.array([] if rngGaussNext is None else [rngGaussNext], dtype=np.float64),
+            "desiredVelocity": np.array([d.desiredVelocity for d in drivers], dtype=np.float64),
+            "appropriateVelocity": np.array([d.appropriateVelocity for d in drivers], dtype=np.float64),
+            "pathNodeIndex": np.array([-1 if d.pathNodeIndex is None else d.pathNodeIndex for d in drivers], dtype=np.int64),
+            "pathLengths": np.array(pathLengths, dtype=np.int64),
+            "pathPoints": np.array(pathPoints, dtype=np.float64).reshape(-1, 2),
+            "pos": np.array([(c.pos.x, c.pos.y) for c in cars], dtype=np.float64).reshape(-1, 2),
+            "prevPos": np.array([(c.prevPos.x, c.prevPos.y) for c in cars], dtype=np.float64).reshape(-1, 2),
+            "prevRotation": np.array([c.prevRotation for c in cars], dtype=np.float64),
+        }
+        for name, fieldType in SCALAR_FIELDS.items():
+            arrays[name] = np.array([getattr(c, name) for c in cars], dtype=fieldType)
+
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        return buffer.getvalue()
+
+    # Saves a snapshot to a file. The snapshot is taken first and written to
+    # a temporary file, so an existing file is only replaced by a complete one
+    def saveSnapshot(self, filePath: str) -> None:
+        snapshot = self.snapshot()
+
+        # NOTE: Unique per process, same as compiled road maps
+        tmpPath = f"{filePath}.{os.getpid()}.tmp"
+        try:
+            with open(tmpPath, "wb") as f:
+                f.write(snapshot)
+            os.replace(tmpPath, filePath)
+        except OSError:
+            try:
+                os.unlink(tmpPath)
+            except FileNotFoundError:
+                pass
+            raise
+
+    # Replaces all drivers and the random generator state with the ones of a
+    # snapshot. The simulation must be on the same map the snapshot was taken
+    # on, and continues exactly as the snapshotted one would
+    def restore(self, snapshot: bytes) -> None:
+        with np.load(io.BytesIO(snapshot), allow_pickle=False) as data:
+            if int(data["formatVersion"]) != SNAPSHOT_FORMAT_VERSION:
+                raise ValueError("Unsupported snapshot format version")
+            if int(data["numNodes"]) != self.roadGraph.numNodes():
+                raise ValueError("Snapshot was taken on a different road map")
+            arrays = {name: data[name] for name in data.files}
+
+        self.seed = int(arrays["seed"].item())
+        gaussNext = arrays["rngGaussNext"].tolist()
+        self.rng.setstate((
+            int(arrays["rngVersion"]),
+            tuple(arrays["rngState"].tolist()),
+            gaussNext[0] if len(gaussNext) > 0 else None,
+        ))
+
+        self.drivers = []
+        if self.carStateStore is not None:
+            self.carStateStore = CarStateStore()
+
+        scalars = {name: arrays[name].tolist() for name in SCALAR_FIELDS}
+        pos = arrays["pos"].tolist()
+        prevPos = arrays["prevPos"].tolist()
+        prevRotation = arrays["prevRotation"].tolist()
+        pathLengths = arrays["pathLengths"].tolist()
+        pathPoints = arrays["pathPoints"].tolist()
+        pathNodeIndex = arrays["pathNodeIndex"].tolist()
+        pathStart = 0
+        for i in range(len(pos)):
+            car = createCar(Vector2(pos[i]), scalars["rotation"][i], loadTextures=not self.headless)
+            for name in SCALAR_FIELDS:
+                setattr(car, name, scalars[name][i])
+            car.prevPos = Vector2(prevPos[i])
+            car.prevRotation = prevRotation[i]
+
+            driver = Driver(car, arrays["desiredVelocity"][i].item(), rng=self.rng)
+            driver.appropriateVelocity = arrays["appropriateVelocity"][i].item()
+            if pathLengths[i] >= 0:
+                pathEnd = pathStart + pathLengths[i]
+                driver.path = [Vector2(p) for p in pathPoints[pathStart:pathEnd]]
+                pathStart = pathEnd
+            driver.pathNodeIndex = pathNodeIndex[i] if pathNodeIndex[i] >= 0 else None
+            self.addDriver(driver)
+
+        self.rebuildDriverGrid(0)
 
     def addDriver(self, driver: Driver) -> None:
+        if self.carStateStore is not None:
+            self.carStateStore.add(driver.car)
         self.drivers.append(driver)
@@ -0,0 +1,198 @@
+from __future__ import annotations
+import json
+import os
+import numpy as np
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from model.traffic_sim import TrafficSim
+
+# First bytes of every trajectory file
+TRAJECTORY_MAGIC = b"TRAJSIM\n"
+
+# Version of the trajectory file layout. Files with a different version are
+# not read
+TRAJECTORY_FORMAT_VERSION = 1
+
+# Size of the file header (magic + JSON metadata, padded with spaces)
+TRAJECTORY_HEADER_SIZE = 1024
+
+# Tolerance (in seconds) when looking up ticks by time, so rounding errors of
+# summed time steps don't land on the previous tick
+TICK_TIME_TOLERANCE = 1e-9
+
+# Default number of ticks buffered in memory before writing them to the file
+DEFAULT_CHUNK_TICKS = 256
+
+# Per-car columns recorded each tick, with their type
+TRAJECTORY_COLUMNS: list[tuple[str, str]] = [
+    ("x", "<f4"),
+    ("y", "<f4"),
+    ("rotation", "<f4"),
+    ("velocity", "<f4"),
+    ("steering", "<f4"),
+    # Driver's index in its current path, or -1 if it has no path
+    ("pathIndex", "<i4"),
+]
+
+# Returns type of a tick record for [numCars] cars: the tick's time step,
+# followed by one column per car attribute, e.g. record["x"] has the x
+# coordinate of every car
+def trajectoryDtype(numCars: int) -> np.dtype:
+    return np.dtype(
+        [("dt", "<f8")] + [(name, fieldType, (numCars,)) for name, fieldType in TRAJECTORY_COLUMNS]
+    )
+
+# Records the state of every car on each update of a traffic simulation, to
+# an append-only binary file that can be read back without loading it whole.
+#
+# The file has a fixed size header (with the number of cars and simulation
+# metadata) followed by one fixed size record per tick. Ticks are first
+# written to a preallocated buffer, which is appended to the file when full,
+# so recording a tick only copies the car states once. Can be used as a
+# context manager, closing the file on exit
+class TrajectoryRecorder:
+    def __init__(
+        self,
+        filePath: str,
+        trafficSim: TrafficSim,
+        chunkTicks: int = DEFAULT_CHUNK_TICKS,
+        metadata: dict | None = None,
+    ) -> None:
+        assert chunkTicks > 0, "Chunk size must be positive"
+
+        self.filePath = filePath
+        self.numCars = len(trafficSim.drivers)
+        self.dtype = trajectoryDtype(self.numCars)
+
+        # Ticks waiting to be written to the file
+        self.buffer = np.zeros(chunkTicks, dtype=self.dtype)
+        self.bufferedTicks = 0
+
+        # Number of ticks recorded so far
+        self.ticks = 0
+
+        header = {
+            "formatVersion": TRAJECTORY_FORMAT_VERSION,
+            "numCars": self.numCars,
+            "roadMap": trafficSim.roadMapFilePath,
+            "roadWidth": trafficSim.roadWidth,
+            "curveArcOffset": trafficSim.curveArcOffset,
+            "seed": trafficSim.seed,
+            **(metadata or {}),
+        }
+        headerBytes = TRAJECTORY_MAGIC + json.dumps(header).encode()
+        assert len(headerBytes) < TRAJECTORY_HEADER_SIZE, "Trajectory metadata doesn't fit in header"
+
+        self.file = open(filePath, "wb")
+        self.file.write(headerBytes.ljust(TRAJECTORY_HEADER_SIZE - 1) + b"\n")
+
+    # Records the current state of all cars in a simulation, after an update
+    # with time step [dt]
+    def record(self, trafficSim: TrafficSim, dt: float) -> None:
+        drivers = trafficSim.drivers
+        assert len(drivers) == self.numCars, "Number of cars changed while recording"
+
+        # NOTE: Gathered into a single array first, so each column is copied
+        # in one go
+        states = np.array(
+            [
+                (
+                    driver.car.pos.x,
+                    driver.car.pos.y,
+                    driver.car.rotation,
+                    driver.car.velocity,
+                    driver.car.steering,
+                    driver.pathNodeIndex if driver.path is not None else -1,
+                )
+                for driver in drivers
+            ],
+            dtype=np.float64,
+        ).reshape(-1, len(TRAJECTORY_COLUMNS))
+
+        row = self.buffer[self.bufferedTicks]
+        row["dt"] = dt
+        for column, (name, _) in enumerate(TRAJECTORY_COLUMNS):
+            row[name] = states[:, column]
+
+        self.bufferedTicks += 1
+        self.ticks += 1
+        if self.bufferedTicks == len(self.buffer):
+            self.flush()
+
+    # Appends all buffered ticks to the file
+    def flush(self) -> None:
+        if self.bufferedTicks > 0:
+            self.file.write(self.buffer[:self.bufferedTicks].tobytes())
+            self.bufferedTicks = 0
+        self.file.flush()
+
+    # Writes remaining ticks and closes the file
+    def close(self) -> None:
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self) -> TrajectoryRecorder:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+# Reads a trajectory file written by a TrajectoryRecorder.
+#
+# Ticks are memory-mapped, so any tick can be read without loading the rest
+# of the file. Only whole ticks are read, so files still being recorded (or
+# cut short) can be read too
+class TrajectoryReader:
+    def __init__(self, filePath: str) -> None:
+        self.filePath = filePath
+
+        with open(filePath, "rb") as f:
+            headerBytes = f.read(TRAJECTORY_HEADER_SIZE)
+        if len(headerBytes) < TRAJECTORY_HEADER_SIZE or not headerBytes.startswith(TRAJECTORY_MAGIC):
+            raise ValueError(f"\"{filePath}\" is not a trajectory file")
+
+        # Metadata saved by the recorder
+        self.header: dict = json.loads(headerBytes[len(TRAJECTORY_MAGIC):])
+        if self.header.get("formatVersion") != TRAJECTORY_FORMAT_VERSION:
+            raise ValueError(f"Unsupported trajectory format version in \"{filePath}\"")
+
+        self.numCars: int = self.header["numCars"]
+        self.dtype = trajectoryDtype(self.numCars)
+
+        # Number of complete ticks in the file
+        self.numTicks = (os.path.getsize(filePath) - TRAJECTORY_HEADER_SIZE) // self.dtype.itemsize
+
+        # NOTE: Files can't be mapped with no records
+        if self.numTicks > 0:
+            self.records = np.memmap(
+                filePath,
+                dtype=self.dtype,
+                mode="r",
+                offset=TRAJECTORY_HEADER_SIZE,
+                shape=(self.numTicks,),
+            )
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+        # Simulated time at the end of each tick, computed when first needed
+        self.tickTimes: np.ndarray | None = None
+
+    # Returns record of a tick. Each column has one value per car, e.g.
+    # reader.tick(10)["x"]
+    def tick(self, index: int) -> np.void:
+        assert 0 <= index < self.numTicks, "Tick out of range"
+        return self.records[index]
+
+    # Returns a column for all ticks, with one row per tick and one column
+    # per car (or a single value per tick for "dt")
+    def column(self, name: str) -> np.ndarray:
+        return self.records[name]
+
+    # Returns index of the tick at simulated time [t] seconds (the last one
+    # that ends at or before it)
+    def tickAtTime(self, t: float) -> int:
+        if self.tickTimes is None:
+            self.tickTimes = np.cumsum(self.records["dt"], dtype=np.float64)
+        return max(0, int(np.searchsorted(self.tickTimes, t + TICK_TIME_TOLERANCE, side="right")) - 1)
@@ -1,14 +1,34 @@
+# NOTE: This import is needed for type annotations of classes only imported for type checking
+from __future__ import annotations
+import heapq
 import math
 import pygame
+from collections import OrderedDict
 from pygame.math import Vector2
+from typing import TYPE_CHECKING
 from model.path import Path
 
+if TYPE_CHECKING:
+    from model.road_graph import RoadGraph
+    from model.profiler import SimProfiler
+
 # Default color for arrow (pink)
 DEFAULT_ARROW_COLOR = (255, 0, 255)
 
 # Default color for text (white)
 DEFAULT_TEXT_COLOR = (255, 255, 255)
 
+# Max number of rendered texts kept for reuse
+MAX_CACHED_TEXTS = 512
+
+# Loaded fonts, keyed by (font type, size, bold, italic). Looking up a system
+# font is slow, so each one is only loaded once
+_fonts: dict[tuple[str, int, bool, bool], pygame.font.Font] = {}
+
+# Rendered text surfaces, keyed by text and all render parameters, from least
+# to most recently used
+_texts: OrderedDict[tuple, pygame.Surface] = OrderedDict()
+
 
 # Draws an arrow, given start and end points
 def drawArrow(
@@ -61,8 +81,7 @@ def drawText(
     if textColor is None:
         textColor = DEFAULT_TEXT_COLOR
 
-    font = pygame.font.SysFont(fontType, round(fontSize), bold, italic)
-    textSurface = font.render(str(text), antiAlias, textColor, bgColor)
+    textSurface = renderText(str(text), fontSize, fontType, bold, italic, antiAlias, textColor, bgColor)
     textRect = textSurface.get_rect()
     textRect.center = Vector2(
         textRect.width * anchorX,
@@ -71,6 +90,59 @@ def drawText(
     surface.blit(textSurface, textRect)
 
 
+# Returns a system font, loading it only the first time it's needed
+def getFont(fontType: str, fontSize: int, bold: bool = False, italic: bool = False) -> pygame.font.Font:
+    key = (fontType, round(fontSize), bold, italic)
+    font = _fonts.get(key)
+    if font is None:
+        font = pygame.font.SysFont(fontType, key[1], bold, italic)
+        _fonts[key] = font
+    return font
+
+# Returns a rendered text surface, reusing it if the same text was recently
+# rendered with the same parameters
+def renderText(
+    text: str,
+    fontSize: int = 18,
+    fontType: str = "comicsans",
+    bold: bool = False,
+    italic: bool = False,
+    antiAlias: bool = False,
+    textColor: tuple = None,
+    bgColor: tuple = None,
+) -> pygame.Surface:
+    if textColor is None:
+        textColor = DEFAULT_TEXT_COLOR
+
+    key = (
+        text,
+        round(fontSize),
+        fontType,
+        bold,
+        italic,
+        antiAlias,
+        tuple(textColor),
+        None if bgColor is None else tuple(bgColor),
+    )
+    textSurface = _texts.get(key)
+    if textSurface is not None:
+        _texts.move_to_end(key)
+        return textSurface
+
+    font = getFont(fontType, fontSize, bold, italic)
+    textSurface = font.render(text, antiAlias, textColor, bgColor)
+    _texts[key] = textSurface
+    while len(_texts) > MAX_CACHED_TEXTS:
+        _texts.popitem(last=False)
+    return textSurface
+
+# Removes all loaded fonts and rendered texts. Needed if pygame.font is
+# quit and initialized again, since old fonts can't be used after that
+def clearTextCaches() -> None:
+    _fonts.clear()
+    _texts.clear()
+
+
 def drawArc(
     surface: pygame.Surface,
     color: tuple,
@@ -328,61 +400,87 @@ def lineLineIntersection(
 def vecToStr(v: Vector2) -> str:
     return f"{v.x:.0f}|{v.y:.0f}"
 
-def A_StarReconstructPath(cameFrom: dict[str, Vector2], current: Vector2) -> list[Vector2]:
-    total_path = [current]
-    while vecToStr(current) in cameFrom.keys():
-        current = cameFrom[vecToStr(current)]
-        total_path.insert(0, current)
+# Returns the path ending at node [current], following [cameFrom] links
+def A_StarReconstructPath(cameFrom: list[int], nodes: list[Vector2], current: int) -> list[Vector2]:
+    total_path = [nodes[current]]
+    while cameFrom[current] != -1:
+        current = cameFrom[current]
+        total_path.append(nodes[current])
+    total_path.reverse()
     return total_path
 
-# A* finds a path from start to goal.
+# A* finds a path from start to goal, given as node ids of [graph].
+# Returns the path as a list of node positions, or None if there's no path.
+# With a [profiler], the number of expanded nodes is counted.
 # https://en.wikipedia.org/wiki/A*_search_algorithm
-def A_Star(graph: dict[str, list[Vector2]], start: Vector2, goal: Vector2):
-    # The set of discovered nodes that may need to be (re-)expanded.
-    # Initially, only the start node is known.
-    # This is usually implemented as a min-heap or priority queue rather than a hash-set.
-    openSet = [start]
+def A_Star(graph: RoadGraph, start: int, goal: int, profiler: SimProfiler | None = None) -> list[Vector2] | None:
+    numNodes = graph.numNodes()
+    nodes = graph.nodeVectors
+    offsets = graph.offsetsList
+    targets = graph.targetsList
+    lengths = graph.lengthsList
+    startPos = nodes[start]
 
     # For node n, cameFrom[n] is the node immediately preceding it on the cheapest path from the start
-    # to n currently known.
-    cameFrom: dict[str, Vector2] = {}
+    # to n currently known (-1 if none).
+    cameFrom: list[int] = [-1] * numNodes
 
     # For node n, gScore[n] is the cost of the cheapest path from start to n currently known.
-    gScore: dict[str, float] = {}
-    gScore[vecToStr(start)] = 0
+    gScore: list[float] = [1e10] * numNodes
+    gScore[start] = 0
 
     # For node n, fScore[n] := gScore[n] + h(n). fScore[n] represents our current best guess as to
     # how cheap a path could be from start to finish if it goes through n.
-    fScore: dict[str, float] = {}
-    fScore[vecToStr(start)] = 0
+    fScore: list[float] = [1e10] * numNodes
+    fScore[start] = 0
+
+    # For node n, openOrder[n] is the order in which it entered the open set, or -1 if it's not in it.
+    # Used as tie-breaker, so nodes with same fScore are expanded in the same order as a list
+    openOrder: list[int] = [-1] * numNodes
+    openOrder[start] = 0
+    nextOrder = 1
+
+    # The set of discovered nodes that may need to be (re-)expanded, as a min-heap of
+    # (fScore, openOrder, node). Entries are not removed when a node's fScore improves,
+    # so outdated entries are skipped when popped.
+    # Initially, only the start node is known.
+    openSet: list[tuple[float, int, int]] = [(0, 0, start)]
+
+    # Number of nodes expanded, for profiling
+    expanded = 0
 
     while len(openSet) > 0:
-        # This operation can occur in O(Log(N)) time if openSet is a min-heap or a priority queue
         # current := the node in openSet having the lowest fScore[] value
-        lowestFscore = 1e10
-        current = None
-        for node in openSet:
-            nodeFscore = fScore.get(vecToStr(node), 1e10)
-            if nodeFscore < lowestFscore:
-                current = node
-                lowestFscore = nodeFscore
+        f, order, current = heapq.heappop(openSet)
+        if openOrder[current] != order or fScore[current] != f:
+            # Outdated entry
+            continue
 
         if current == goal:
-            return A_StarReconstructPath(cameFrom, current)
+            if profiler is not None:
+                profiler.count("astarExpansions", expanded)
+            return A_StarReconstructPath(cameFrom, nodes, current)
+
+        expanded += 1
+        openOrder[current] = -1
+        currentG = gScore[current]
+        for edge in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[edge]
 
-        openSet.remove(current)
-        neighbors = graph.get(vecToStr(current), [])
-        for neighbor in neighbors:
             # d(current,neighbor) is the weight of the edge from current to neighbor
             # tentative_gScore is the distance from start to the neighbor through current
-            tentative_gScore = gScore.get(vecToStr(current), 1e10) + current.distance_to(neighbor)
-            if tentative_gScore < gScore.get(vecToStr(neighbor), 1e10):
+            tentative_gScore = currentG + lengths[edge]
+            if tentative_gScore < gScore[neighbor]:
                 # This path to neighbor is better than any previous one. Record it!
-                cameFrom[vecToStr(neighbor)] = current
-                gScore[vecToStr(neighbor)] = tentative_gScore
-                fScore[vecToStr(neighbor)] = tentative_gScore + start.distance_to(neighbor)
-                if neighbor not in openSet:
-                    openSet.append(neighbor)
+                cameFrom[neighbor] = current
+                gScore[neighbor] = tentative_gScore
+                fScore[neighbor] = tentative_gScore + startPos.distance_to(nodes[neighbor])
+                if openOrder[neighbor] == -1:
+                    openOrder[neighbor] = nextOrder
+                    nextOrder += 1
+                heapq.heappush(openSet, (fScore[neighbor], openOrder[neighbor], neighbor))
 
     # Open set is empty but goal was never reached
-    return None
\ No newline at end of file
+    if profiler is not None:
+        profiler.count("astarExpansions", expanded)
+    return None
@@ -0,0 +1,221 @@
+from model.app import PygameApp
+from model.trajectory import TrajectoryReader
+from model.traffic_sim import createCar, CAR_DRAW_MARGIN, ROAD_WIDTH, CURVE_ARC_OFFSET
+from model.road_map_cache import loadCompiledRoadMap
+from model.road_layer import RoadLayer
+import utils
+import numpy as np
+import pygame
+from pygame.event import Event
+from pygame.math import Vector2
+
+# Playback speeds, changed with the up and down arrow keys
+PLAYBACK_SPEEDS = [0.25, 0.5, 1, 2, 4, 8, 16, 32]
+
+# Height of the timeline bar at the bottom of the window, clicked or dragged
+# to seek
+TIMELINE_HEIGHT = 12
+
+# Pygame app to replay car trajectories recorded by a TrajectoryRecorder.
+#
+# Cars are drawn straight from the recorded states (read from the memory-mapped
+# file), without updating any simulation, so playback costs the same no matter
+# how expensive the recorded simulation was
+class ReplayApp(PygameApp):
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        trajectoryFilePath: str,
+        fps: float = 60,
+        roadMapFilePath: str | None = None,
+    ) -> None:
+        # Base class init
+        super().__init__(width, height, fps)
+
+        # Recorded trajectories
+        self.reader = TrajectoryReader(trajectoryFilePath)
+        assert self.reader.numTicks > 0, "Trajectory file has no recorded ticks"
+
+        # Simulated time at the end of each tick
+        self.tickTimes = np.cumsum(self.reader.column("dt"), dtype=np.float64)
+
+        # Road map, the recorded one by default
+        header = self.reader.header
+        roadMap = loadCompiledRoadMap(
+            roadMapFilePath if roadMapFilePath is not None else header["roadMap"],
+            header.get("roadWidth", ROAD_WIDTH),
+            header.get("curveArcOffset", CURVE_ARC_OFFSET),
+        )
+
+        # Roads pre-rendered by chunks, since they never change
+        self.roadLayer = RoadLayer(roadMap.roads, roadMap.points, roadMap.roadGraph)
+
+        # One car per recorded car, only used to draw the recorded states
+        self.cars = [createCar(Vector2(0, 0), 0) for _ in range(self.reader.numCars)]
+
+        # Current playback time, in simulated seconds
+        self.playTime = float(self.tickTimes[0])
+
+        # Whether playback is running (useful for pausing)
+        self.playing = True
+
+        # Index of the current playback speed in PLAYBACK_SPEEDS
+        self.speedIndex = PLAYBACK_SPEEDS.index(1)
+
+        # Whether debug rendering is on
+        self.debug = False
+
+        # Rendering offset, serving as camera position
+        self.cameraOffset = Vector2(0, 0)
+
+        # Whether the timeline is being dragged
+        self.seeking = False
+
+    def onEvent(self, event: Event) -> None:
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            self.running = False
+        # Check for key presses
+        elif event.type == pygame.KEYDOWN:
+            # Debug toggle
+            if event.key == pygame.K_f:
+                self.debug = not self.debug
+            # Toggle playback
+            elif event.key in (pygame.K_SPACE, pygame.K_v):
+                self.playing = not self.playing
+            # Step a single tick, pausing playback
+            elif event.key == pygame.K_LEFT:
+                self.playing = False
+                self.seekTick(self.currentTick() - 1)
+            elif event.key == pygame.K_RIGHT:
+                self.playing = False
+                self.seekTick(self.currentTick() + 1)
+            # Playback speed
+            elif event.key == pygame.K_UP:
+                self.speedIndex = min(self.speedIndex + 1, len(PLAYBACK_SPEEDS) - 1)
+            elif event.key == pygame.K_DOWN:
+                self.speedIndex = max(self.speedIndex - 1, 0)
+            # Jump to start or end
+            elif event.key == pygame.K_HOME:
+                self.seekTick(0)
+            elif event.key == pygame.K_END:
+                self.seekTick(self.reader.numTicks - 1)
+        # Start seeking when clicking the timeline
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            if event.pos[1] >= self.height - TIMELINE_HEIGHT:
+                self.seeking = True
+                self.seekWindowX(event.pos[0])
+        elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+            self.seeking = False
+        # Check for mouse motion
+        elif event.type == pygame.MOUSEMOTION and event.buttons[0]:
+            if self.seeking:
+                self.seekWindowX(event.pos[0])
+            else:
+                self.cameraOffset += Vector2(event.rel)
+
+    # Returns index of the tick shown at the current playback time
+    def currentTick(self) -> int:
+        return self.reader.tickAtTime(self.playTime)
+
+    # Moves playback to the end of a tick
+    def seekTick(self, tick: int) -> None:
+        tick = utils.clamp(tick, 0, self.reader.numTicks - 1)
+        self.playTime = float(self.tickTimes[tick])
+
+    # Moves playback to the time under an x coordinate of the timeline
+    def seekWindowX(self, x: float) -> None:
+        progress = utils.clamp(x / self.width, 0, 1)
+        self.playTime = float(self.tickTimes[0] + progress * (self.tickTimes[-1] - self.tickTimes[0]))
+
+    # Sets the state of the visible cars at the current playback time.
+    # Returns their indices, and how far into the next tick they are drawn
+    def updateCars(self, viewBounds: tuple[float, float, float, float]) -> tuple[list[int], float]:
+        tick = self.currentTick()
+        nextTick = min(tick + 1, self.reader.numTicks - 1)
+        current = self.reader.tick(tick)
+        following = self.reader.tick(nextTick)
+
+        # How far into the next tick cars are drawn
+        if nextTick == tick:
+            alpha = 1.0
+        else:
+            alpha = utils.clamp((self.playTime - self.tickTimes[tick]) / following["dt"], 0, 1)
+
+        # Only cars near the view, at either tick
+        minX, minY, maxX, maxY = viewBounds
+        visible = np.zeros(self.reader.numCars, dtype=bool)
+        for record in (current, following):
+            visible |= (
+                (record["x"] >= minX - CAR_DRAW_MARGIN) & (record["x"] <= maxX + CAR_DRAW_MARGIN) &
+                (record["y"] >= minY - CAR_DRAW_MARGIN) & (record["y"] <= maxY + CAR_DRAW_MARGIN)
+            )
+        indices = np.flatnonzero(visible).tolist()
+
+        # NOTE: Cars interpolate between their previous and current states
+        # when drawn, so the current tick becomes the previous state
+        for i in indices:
+            car = self.cars[i]
+            car.prevPos = Vector2(float(current["x"][i]), float(current["y"][i]))
+            car.prevRotation = float(current["rotation"][i])
+            car.pos = Vector2(float(following["x"][i]), float(following["y"][i]))
+            car.rotation = float(following["rotation"][i])
+            car.velocity = float(following["velocity"][i])
+            car.steering = float(following["steering"][i])
+        return indices, alpha
+
+    # Draws the timeline bar, with the current playback position
+    def drawTimeline(self) -> None:
+        top = self.height - TIMELINE_HEIGHT
+        pygame.draw.rect(self.window, (60, 60, 60), (0, top, self.width, TIMELINE_HEIGHT))
+
+        duration = self.tickTimes[-1] - self.tickTimes[0]
+        progress = (self.playTime - self.tickTimes[0]) / duration if duration > 0 else 1
+        pygame.draw.rect(self.window, (255, 127, 0), (0, top, round(self.width * progress), TIMELINE_HEIGHT))
+
+    def onUpdate(self, dt: float) -> None:
+        # Advance playback, stopping at the end
+        if self.playing and not self.seeking:
+            self.playTime += dt * PLAYBACK_SPEEDS[self.speedIndex]
+            if self.playTime >= self.tickTimes[-1]:
+                self.playTime = float(self.tickTimes[-1])
+                self.playing = False
+
+        # Clear window
+        self.window.fill((0, 0, 0))
+
+        # Draw the visible roads (and debug points and graph)
+        self.roadLayer.draw(self.window, self.cameraOffset, self.debug)
+
+        # Draw the visible cars
+        viewBounds = (
+            -self.cameraOffset.x,
+            -self.cameraOffset.y,
+            -self.cameraOffset.x + self.width,
+            -self.cameraOffset.y + self.height,
+        )
+        indices, alpha = self.updateCars(viewBounds)
+        for i in indices:
+            self.cars[i].draw(self.window, self.cameraOffset, self.debug, alpha)
+
+        self.drawTimeline()
+
+        tick = self.currentTick()
+        utils.drawText(
+            self.window,
+            f"Tick {tick + 1}/{self.reader.numTicks}  {self.playTime:.2f}s  "
+            f"x{PLAYBACK_SPEEDS[self.speedIndex]:g}{'' if self.playing else '  (paused)'}",
+            Vector2(5, self.height - TIMELINE_HEIGHT - 5),
+            anchorX=0.5,
+            anchorY=-0.5,
+            fontSize=20,
+        )
+
+        utils.drawText(
+            self.window,
+            f"FPS: {self.clock.get_fps():.0f}",
+            Vector2(self.width - 5, self.height - TIMELINE_HEIGHT - 5),
+            anchorX=-0.5,
+            anchorY=-0.5,
+            fontSize=20,
+        )
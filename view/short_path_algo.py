@@ -2,11 +2,11 @@ from typing import Callable
 import pygame
 import utils
 import math
-import json
 from pygame.event import Event
 from pygame.math import Vector2
 from model.app import PygameApp
-from model.road import Road, RoadLine, roadRules
+from model.road import Road
+from model.road_map_cache import loadCompiledRoadMap
 from random import randint
 
 # App for testing path algorithm and map loading
@@ -28,67 +28,22 @@ class ShortPathAlgorithmApp(PygameApp):
         self.path = None
         self.dma = None
 
+        # Also sets the nodes graph compiled for creating paths with A*
         self.loadRoadMap(roadMapFilePath)
 
     def loadRoadMap(self, filePath: str) -> None:
-        roadLines: list[RoadLine] = []
-        with open(filePath, "r") as f:
-            lst = json.load(f)
-            for obj in lst:
-                # Multiply all coordinates by 2 to create between-tile spacing
-                roadLines.append(RoadLine(
-                    Vector2(
-                        obj["start"]["x"] * 2,
-                        obj["start"]["y"] * 2,
-                    ),
-                    Vector2(
-                        obj["end"]["x"] * 2,
-                        obj["end"]["y"] * 2,
-                    ),
-                ))
-
         # TODO: What to do after loading road lines from JSON:
         # - Get road full path by traversing through road connections (start to end, or end to start)
         # - Get curve points by checking angle difference between points
         # - Generate points for both left and right ways on each curve's start/end points
         # - Generate points graph to be able to use A* algorithm for path generation
-        minX = minY = 1e10
-        maxX = maxY = -1e10
-        for roadLine in roadLines:
-            minX = min(minX, roadLine.start.x, roadLine.end.x)
-            minY = min(minY, roadLine.start.y, roadLine.end.y)
-            maxX = max(maxX, roadLine.start.x, roadLine.end.x)
-            maxY = max(maxY, roadLine.start.y, roadLine.end.y)
-        minX = int(minX)
-        minY = int(minY)
-        maxX = int(maxX)
-        maxY = int(maxY)
-        sizeX = maxX - minX + 1
-        sizeY = maxY - minY  +1
-        size = Vector2(sizeX, sizeY)
-
-        # Create tile map filled with zeros and change to 1 on all road tiles
-        self.tiles = [[0] * sizeX for _ in range(sizeY)]
-        # TODO: Maybe this could be optimized
-        for j in range(sizeY):
-            for i in range(sizeX):
-                p = Vector2(i + minX, j + minY)
-                for line in roadLines:
-                    if line.contains(p):
-                        self.tiles[j][i] = 1
-
-        # Check rules to identify curves and calculate node points
-        for rule, callback in roadRules:
-            lines = rule.split("|")
-            sx = int(lines[0])
-            sy = int(lines[1])
-
-            for y in range(sizeY - sy + 1):
-                for x in range(sizeX - sx + 1):
-                    # Get new possible roads and points
-                    roads, points = callback(Vector2(x, y), self.tiles, self.nodesGraph, size, 110, 45)
-                    self.roads.extend(roads)
-                    self.points.extend(points)
+
+        roadMap = loadCompiledRoadMap(filePath, 110, 45)
+        self.roads.extend(roadMap.roads)
+        self.points.extend(roadMap.points)
+        self.nodesGraph.update(roadMap.nodesGraph)
+        self.tiles = roadMap.tiles.tolist()
+        self.roadGraph = roadMap.roadGraph
 
     def generateLinearGraph(self, points: list[Vector2]) -> None:
         if len(self.points) == 0:
@@ -117,9 +72,9 @@ class ShortPathAlgorithmApp(PygameApp):
             end = randint(0, len(self.points) - 1)
         self.endNodeIndex = end
 
-        startPoint = self.points[self.startNodeIndex]
-        endPoint = self.points[self.endNodeIndex]
-        self.path = utils.A_Star(self.nodesGraph, startPoint, endPoint)
+        startNode = self.roadGraph.pointIdsList[self.startNodeIndex]
+        endNode = self.roadGraph.pointIdsList[self.endNodeIndex]
+        self.path = utils.A_Star(self.roadGraph, startNode, endNode)
 
     def onEvent(self, event: Event) -> None:
         if event.type == pygame.KEYDOWN:
@@ -148,10 +103,9 @@ class ShortPathAlgorithmApp(PygameApp):
         for point in self.points:
             pygame.draw.circle(self.window, (0, 127, 255), point + self.cameraOffset, 5, 2)
 
-        for node, connections in self.nodesGraph.items():
-            x, y = node.split("|")
-            start = Vector2(int(x), int(y))
-            for p in connections:
+        for node, start in enumerate(self.roadGraph.nodeVectors):
+            for neighbor in self.roadGraph.neighbors(node):
+                p = self.roadGraph.nodeVectors[neighbor]
                 utils.drawArrow(self.window, start + self.cameraOffset, p + self.cameraOffset, (255, 0, 127), 2)
 
         if self.path != None:
@@ -1,23 +1,56 @@
 from model.app import PygameApp
-from model.traffic_sim import TrafficSim
+from model.traffic_sim import TrafficSim, ROAD_WIDTH, CURVE_ARC_OFFSET
+from model.road_layer import RoadLayer
+from model.profiler import SimProfiler
 import utils
 import math
+import time
 import pygame
 from pygame.event import Event
 from pygame.math import Vector2
 
-# Tile size
-ROAD_WIDTH = 110
+# Default simulation updates per second of simulated time
+DEFAULT_SIM_RATE = 60
 
-# Curve arc offset
-CURVE_ARC_OFFSET = 45
+# Default max simulation updates in a single frame (at normal speed). If the
+# simulation falls further behind, the remaining time is dropped instead of
+# making every following frame even slower trying to catch up
+MAX_SIM_STEPS_PER_FRAME = 8
+
+# How much faster simulation time goes with fast update on
+FAST_UPDATE_SPEED = 6
+
+# Frames between refreshes of the profiler overlay text
+PROFILER_OVERLAY_REFRESH = 30
 
 # Pygame app to show a traffic simulation
 class TrafficSimulationApp(PygameApp):
-    def __init__(self, width: int, height: int, roadMapFilePath: str, numCars: int = 1, fps: float = 60) -> None:
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        roadMapFilePath: str,
+        numCars: int = 1,
+        fps: float = 60,
+        simRate: float = DEFAULT_SIM_RATE,
+        maxStepsPerFrame: int = MAX_SIM_STEPS_PER_FRAME,
+        seed: int | None = None,
+        profile: bool = False,
+    ) -> None:
+        assert simRate > 0 and maxStepsPerFrame > 0, "Simulation rate and max steps must be positive"
+
         # Base class init
         super().__init__(width, height, fps)
 
+        # Simulation time step, always the same no matter the frame rate
+        self.simDt = 1 / simRate
+
+        # Max simulation updates in a single frame, at normal speed
+        self.maxStepsPerFrame = maxStepsPerFrame
+
+        # Time waiting to be simulated, always less than [simDt] after a frame
+        self.simAccumulator = 0.0
+
         # Whether debug rendering is on
         self.debug = False
 
@@ -49,7 +82,22 @@ class TrafficSimulationApp(PygameApp):
         self.leftMouseButtonDown = False
 
         # Traffic simulation
-        self.trafficSim = TrafficSim(ROAD_WIDTH, CURVE_ARC_OFFSET, roadMapFilePath, numCars)
+        self.trafficSim = TrafficSim(ROAD_WIDTH, CURVE_ARC_OFFSET, roadMapFilePath, numCars, seed=seed)
+
+        # Profiler overlay text lines, refreshed every few frames so they
+        # can be read
+        self.profilerLines: list[str] = []
+        self.profilerFrame = 0
+        if profile:
+            self.toggleProfiler()
+
+        # Roads pre-rendered by chunks, since they never change
+        self.roadLayer = RoadLayer(self.trafficSim.roads, self.trafficSim.points, self.trafficSim.roadGraph)
+
+        # Traffic drawing surface, reused every frame. It is rotated around
+        # the window center, so it needs to cover the window's diagonal
+        trafficSize = math.ceil(math.hypot(self.width, self.height)) + 2
+        self.trafficSurface = pygame.Surface((trafficSize, trafficSize)).convert()
 
     def onEvent(self, event: Event) -> None:
         if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
@@ -84,6 +132,9 @@ class TrafficSimulationApp(PygameApp):
                 self.cameraRotateDirection += 1
             elif event.key == pygame.K_h:
                 self.fastUpdate = not self.fastUpdate
+            # Profiler toggle
+            elif event.key == pygame.K_p:
+                self.toggleProfiler()
         # Check for key releases
         elif event.type == pygame.KEYUP:
             # Camera rotation
@@ -97,6 +148,57 @@ class TrafficSimulationApp(PygameApp):
                 math.degrees(self.cameraRotation),
             )
 
+    # Starts profiling the simulation (showing the profiler overlay), or stops
+    # it if already profiling
+    def toggleProfiler(self) -> None:
+        if self.trafficSim.profiler is None:
+            self.trafficSim.setProfiler(SimProfiler())
+        else:
+            self.trafficSim.setProfiler(None)
+        self.profilerLines = []
+        self.profilerFrame = 0
+
+    # Draws profiler statistics on the window's top left corner
+    def drawProfilerOverlay(self) -> None:
+        profiler = self.trafficSim.profiler
+        if self.profilerFrame % PROFILER_OVERLAY_REFRESH == 0:
+            stats = profiler.stats()
+            self.profilerLines = [f"Profiler ({stats['ticks']} ticks)"]
+            for phase, s in stats["phases"].items():
+                self.profilerLines.append(
+                    f"{phase}: {s['mean']:.2f} ms  p50 {s['p50']:.2f}  p90 {s['p90']:.2f}  p99 {s['p99']:.2f}"
+                )
+            for name, s in stats["counters"].items():
+                self.profilerLines.append(f"{name}: {s['mean']:.0f}  p99 {s['p99']:.0f}")
+        self.profilerFrame += 1
+
+        for i, line in enumerate(self.profilerLines):
+            utils.drawText(
+                self.window,
+                line,
+                Vector2(5, 5 + i * 18),
+                anchorX=0.5,
+                anchorY=0.5,
+                fontSize=16,
+                bgColor=(0, 0, 0),
+            )
+
+    # Runs as many fixed simulation updates as fit in the frame's time
+    def stepSimulation(self, dt: float) -> None:
+        speed = FAST_UPDATE_SPEED if self.fastUpdate else 1
+        maxSteps = self.maxStepsPerFrame * speed
+
+        self.simAccumulator += dt * speed
+        steps = 0
+        while self.simAccumulator >= self.simDt and steps < maxSteps:
+            self.trafficSim.update(self.simDt)
+            self.simAccumulator -= self.simDt
+            steps += 1
+
+        # Too far behind, drop the time left
+        if self.simAccumulator >= self.simDt:
+            self.simAccumulator = 0.0
+
     def onUpdate(self, dt: float) -> None:
         # Get mouse buttons state
         left, middle, right = pygame.mouse.get_pressed(3)
@@ -106,76 +208,68 @@ class TrafficSimulationApp(PygameApp):
         if not self.isFocused:
             self.cameraRotation += self.cameraRotateDirection * self.cameraRotateSpeed * dt
 
+        # Update traffic in fixed steps
+        if self.update:
+            self.stepSimulation(dt)
+
+        # How far into the next update cars are drawn
+        alpha = self.simAccumulator / self.simDt
+
         # Get focused car offset
         if self.isFocused:
             focusedCar = self.trafficSim.drivers[self.focusedIndex].car
-            worldOffset = -focusedCar.pos + Vector2(self.width, self.height)
+            worldOffset = -focusedCar.interpolatedPos(alpha) + Vector2(self.width, self.height)
         else:
             worldOffset = self.cameraOffset
 
+        # Time drawing, if profiling
+        drawStart = time.perf_counter_ns()
+
         # Clear window
         self.window.fill((0, 0, 0))
 
-        # Traffic drawing surface
-        trafficSurface = pygame.Surface((self.width * 2, self.height * 2))
-
-        # Draw the roads
-        for road in self.trafficSim.roads:
-            road.draw(trafficSurface, worldOffset, self.debug)
+        # Clear traffic drawing surface. The surface center is drawn on the
+        # window center, so move the world offset to match
+        trafficSurface = self.trafficSurface
+        trafficSurface.fill((0, 0, 0))
+        trafficSize = trafficSurface.get_width()
+        drawOffset = worldOffset + Vector2(trafficSize / 2 - self.width, trafficSize / 2 - self.height)
 
-        if self.debug:
-            for point in self.trafficSim.points:
-                pygame.draw.circle(trafficSurface, (0, 127, 255), point + worldOffset, 5, 2)
+        # World area covered by the traffic surface
+        viewBounds = (
+            -drawOffset.x,
+            -drawOffset.y,
+            -drawOffset.x + trafficSize,
+            -drawOffset.y + trafficSize,
+        )
 
-            for node, connections in self.trafficSim.nodesGraph.items():
-                x, y = node.split("|")
-                start = Vector2(int(x), int(y))
-                for p in connections:
-                    utils.drawArrow(trafficSurface, start + worldOffset, p + worldOffset, (255, 0, 127), 2)
+        # Draw the visible roads (and debug points and graph)
+        self.roadLayer.draw(trafficSurface, drawOffset, self.debug)
 
-        # Update and draw traffic
-        if self.update:
-            if self.fastUpdate:
-                for _ in range(5):
-                    self.trafficSim.update(1/self.fps)
-            self.trafficSim.update(1/self.fps)
-        self.trafficSim.draw(trafficSurface, worldOffset, self.debug)
+        # Draw traffic
+        self.trafficSim.draw(trafficSurface, drawOffset, self.debug, viewBounds, alpha)
 
-        # Check if any car is focused
+        # Get traffic surface rotation, based on focused car or on current
+        # camera rotation
         if self.isFocused:
             focusedCar = self.trafficSim.drivers[self.focusedIndex].car
-
-            # Get rotated traffic surface based on focused car
-            rotatedTraffic = pygame.transform.rotate(
-                trafficSurface,
-                math.degrees(focusedCar.rotation + math.pi / 2),
-            )
-            trafficRect = rotatedTraffic.get_rect(
-                center=trafficSurface.get_rect(
-                    center=(
-                        self.width/2,
-                        self.height/2,
-                    ),
-                ).center,
-            )
+            rotation = math.degrees(focusedCar.interpolatedRotation(alpha) + math.pi / 2)
         else:
-            # Get rotated traffic surface based on current camera rotation
-            rotatedTraffic = pygame.transform.rotate(
-                trafficSurface,
-                math.degrees(self.cameraRotation),
-            )
-            trafficRect = rotatedTraffic.get_rect(
-                center=trafficSurface.get_rect(
-                    center=(
-                        self.width/2,
-                        self.height/2,
-                    ),
-                ).center,
-            )
+            rotation = math.degrees(self.cameraRotation)
 
-        # Draw rotated traffic surface on window
+        # Draw rotated traffic surface on window center (no need to rotate
+        # when the camera isn't rotated)
+        if rotation % 360 == 0:
+            rotatedTraffic = trafficSurface
+        else:
+            rotatedTraffic = pygame.transform.rotate(trafficSurface, rotation)
+        trafficRect = rotatedTraffic.get_rect(center=(self.width / 2, self.height / 2))
         self.window.blit(rotatedTraffic, trafficRect)
 
+        if self.trafficSim.profiler is not None:
+            self.trafficSim.profiler.sample("draw", time.perf_counter_ns() - drawStart)
+            self.drawProfilerOverlay()
+
         # Draw text indicating which car is focused
         utils.drawText(
             surface=self.window,